@@ -3,6 +3,7 @@ Dexcom 血糖可视化 - Flask 后端（多人版 + Passkey 认证）
 """
 import os
 import json
+import hashlib
 import functools
 import threading
 from datetime import datetime, timedelta
@@ -16,11 +17,11 @@ from data_fetcher import (
     get_all_users_glucose,
     get_user_list
 )
-from config import USERS, THRESHOLDS, PK_SETTINGS
+from config import USERS, USER_LIST, THRESHOLDS, PK_SETTINGS
 
 # 导入同步服务
 try:
-    from sync_service import start_sync_service, get_sync_status
+    from sync_service import start_sync_service, get_sync_status, load_player_data
     SYNC_SERVICE_ENABLED = True
 except ImportError:
     SYNC_SERVICE_ENABLED = False
@@ -398,16 +399,44 @@ def api_user_history(user_id):
     return jsonify(result)
 
 
+def _players_etag(results: list) -> str:
+    """
+    根据每个玩家的读数时间生成版本号（用于 ETag）
+    
+    CGM 每 5 分钟才出一个新读数，读数时间和显示信息都没变时版本号不变
+    """
+    parts = []
+    for r in results:
+        reading = r.get("data") or {}
+        parts.append("|".join(str(x) for x in (
+            r.get("user_id"), r.get("success"), reading.get("datetime"), r.get("error"),
+            r.get("user_name"), r.get("avatar"), r.get("color"),
+        )))
+    return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=8).hexdigest()
+
+
 @app.route('/api/pk/all')
 @login_required
 def api_pk_all():
-    """获取所有用户的当前血糖（用于PK）"""
+    """
+    获取所有用户的当前血糖（用于PK）
+    
+    支持 ETag：所有玩家读数都没有变化时返回 304，不再重复序列化
+    """
     results = get_all_users_glucose()
-    return jsonify({
+    
+    etag = _players_etag(results)
+    if request.if_none_match.contains_weak(etag):
+        return "", 304, {"ETag": f'W/"{etag}"', "Cache-Control": "no-cache"}
+    
+    response = jsonify({
         "success": True,
         "timestamp": datetime.now().isoformat(),
         "players": results
     })
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.route('/api/pk/history')
@@ -463,17 +492,9 @@ def api_sync_status():
 @login_required
 def api_pk_players():
     """获取可选的 Dexcom 玩家列表（用于身份选择）"""
-    players = []
-    for user_id, info in USERS.items():
-        players.append({
-            "id": user_id,
-            "name": info["name"],
-            "avatar": info["avatar"],
-            "color": info["color"]
-        })
     return jsonify({
         "success": True,
-        "players": players
+        "players": list(USER_LIST)
     })
 
 
@@ -643,11 +664,9 @@ def calculate_daily_tir(user_id, date_str):
         float: 0-1 之间的比例，或 None（无数据）
     """
     try:
-        # 从本地数据获取
+        # 从本地数据获取（与 get_glucose_history 一样，user_id 即玩家 ID）
         if SYNC_SERVICE_ENABLED:
-            from sync_service import load_user_data
-            local_data = load_user_data(user_id)
-            history = local_data.get("history", [])
+            history = load_player_data(user_id).get("history", [])
         else:
             # Fallback: 从 API 获取
             result = get_glucose_history(user_id, minutes=1440, max_count=288)
@@ -659,17 +678,12 @@ def calculate_daily_tir(user_id, date_str):
             return None
         
         # 过滤出指定日期的数据
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        day_readings = []
-        
-        for reading in history:
-            try:
-                dt_str = reading.get("datetime", "")
-                reading_time = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
-                if reading_time.date() == target_date:
-                    day_readings.append(reading["value"])
-            except:
-                continue
+        # 读数时间都是 isoformat() 字符串，前 10 位就是读数当地的日期，不必逐条解析
+        target_date = datetime.strptime(date_str, "%Y-%m-%d").date().isoformat()
+        day_readings = [
+            reading["value"] for reading in history
+            if reading.get("datetime", "")[:10] == target_date and reading.get("value") is not None
+        ]
         
         if not day_readings:
             return None
@@ -32,9 +32,12 @@ data/cgm_devices/
 """
 
 import os
+import copy
 import json
 import uuid
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, List, Dict, Any
@@ -56,28 +59,16 @@ CGM_DEVICES_DIR = os.path.join(
 DEFAULT_AVATARS = ["🩸", "💉", "📊", "🎯", "⭐", "🌟", "💫", "🔥"]
 DEFAULT_COLORS = ["#4CAF50", "#2196F3", "#FF9800", "#E91E63", "#9C27B0", "#00BCD4"]
 
+# 批量读取设备配置的线程数
+CONFIG_LOAD_WORKERS = 8
+
 
 # ==================== 加密工具 ====================
 
 def _get_cipher():
-    """获取加密器（复用 password_manager 的逻辑）"""
-    from cryptography.fernet import Fernet
-    
-    # 优先从环境变量读取
-    env_key = os.getenv("ENCRYPTION_KEY")
-    if env_key:
-        key = env_key.encode() if isinstance(env_key, str) else env_key
-    else:
-        # 从文件读取或创建
-        key_file = Path(".secret_key")
-        if key_file.exists():
-            key = key_file.read_bytes()
-        else:
-            key = Fernet.generate_key()
-            key_file.write_bytes(key)
-            print(f"✅ 已生成加密密钥: .secret_key")
-    
-    return Fernet(key)
+    """获取加密器（与 password_manager 共用同一个 Fernet 实例，密钥进程内只读一次）"""
+    from password_manager import EncryptedBackend
+    return EncryptedBackend._get_fernet()
 
 
 def _encrypt(value: str) -> str:
@@ -117,6 +108,34 @@ def _decrypt_credentials(credentials: dict) -> dict:
     return decrypted
 
 
+# ==================== 玩家 ID ====================
+
+@lru_cache(maxsize=1024)
+def parse_player_id(player_id: str) -> tuple:
+    """
+    解析 player_id 为 (username, device_id)
+    
+    player_id 格式: {username}_{device_type}_{uuid}
+    例如: amy_dexcom_abc12345
+    
+    注意：username 可能包含下划线，但 device_id 的格式是固定的 {type}_{uuid}
+    """
+    if not player_id:
+        return None, None
+    
+    # 从右边找，因为 device_id 格式固定
+    parts = player_id.rsplit("_", 2)
+    
+    if len(parts) == 3:
+        # 正常情况：username_devicetype_uuid
+        return parts[0], f"{parts[1]}_{parts[2]}"
+    if len(parts) == 2:
+        # 简单格式：username_deviceid
+        return parts[0], parts[1]
+    
+    return None, None
+
+
 # ==================== CGM 管理器 ====================
 
 class CGMManager:
@@ -126,41 +145,93 @@ class CGMManager:
         self._locks: Dict[str, threading.Lock] = {}
         self._provider_cache: Dict[str, BaseCGMProvider] = {}
         
+        # 只在创建新锁 / 新 Provider 时使用，命中缓存的读取不加锁
+        self._locks_guard = threading.Lock()
+        self._provider_lock = threading.Lock()
+        
+        # 配置缓存：username -> ((文件 mtime_ns, 大小), 配置)
+        self._config_cache: Dict[str, tuple] = {}
+        
+        # 批量读取配置的线程池（get_all_active_devices 使用）
+        self._io_pool = ThreadPoolExecutor(
+            max_workers=CONFIG_LOAD_WORKERS,
+            thread_name_prefix="cgm-config"
+        )
+        
         # 确保目录存在
         os.makedirs(CGM_DEVICES_DIR, exist_ok=True)
     
     def _get_lock(self, username: str) -> threading.Lock:
         """获取用户的文件锁"""
-        if username not in self._locks:
-            self._locks[username] = threading.Lock()
-        return self._locks[username]
+        lock = self._locks.get(username)
+        if lock is not None:
+            return lock
+        
+        with self._locks_guard:
+            return self._locks.setdefault(username, threading.Lock())
     
     def _get_user_file(self, username: str) -> Path:
         """获取用户配置文件路径"""
         return Path(CGM_DEVICES_DIR) / f"{username}.json"
     
     def _load_user_config(self, username: str) -> dict:
-        """加载用户配置"""
+        """
+        加载用户配置
+        
+        文件 (mtime, size) 未变时直接使用缓存（多进程部署下其他 worker 的写入
+        会改变签名，从而触发重新读取）。返回副本，调用方可以随意修改。
+        """
         filepath = self._get_user_file(username)
-        if filepath.exists():
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"⚠️ 加载 {username} 设备配置失败: {e}")
+        try:
+            st = filepath.stat()
+        except OSError:
+            return {"devices": [], "default_device": None}
         
-        return {"devices": [], "default_device": None}
+        cached = self._config_cache.get(username)
+        if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+            return copy.deepcopy(cached[1])
+        
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                # 签名取自读取用的同一个文件，stat 之后文件被替换也不会和内容对不上
+                st = os.fstat(f.fileno())
+                config = json.load(f)
+        except Exception as e:
+            print(f"⚠️ 加载 {username} 设备配置失败: {e}")
+            return {"devices": [], "default_device": None}
+        
+        self._config_cache[username] = ((st.st_mtime_ns, st.st_size), config)
+        return copy.deepcopy(config)
+    
+    def _is_config_cached(self, username: str) -> bool:
+        """检查用户配置缓存是否仍然有效"""
+        cached = self._config_cache.get(username)
+        if not cached:
+            return False
+        try:
+            st = self._get_user_file(username).stat()
+            return (st.st_mtime_ns, st.st_size) == cached[0]
+        except OSError:
+            return False
     
     def _save_user_config(self, username: str, config: dict):
         """保存用户配置"""
         filepath = self._get_user_file(username)
         with self._get_lock(username):
             try:
-                # 原子写入
-                temp_file = str(filepath) + ".tmp"
+                # 原子写入：临时文件带进程号，多个 worker 同时保存同一用户时互不覆盖；
+                # 签名在替换前从临时文件取得，替换后其他 worker 的写入不会被当成本进程的缓存
+                temp_file = f"{filepath}.{os.getpid()}.tmp"
                 with open(temp_file, 'w', encoding='utf-8') as f:
                     json.dump(config, f, indent=2, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    st = os.fstat(f.fileno())
                 os.replace(temp_file, filepath)
+                self._config_cache[username] = (
+                    (st.st_mtime_ns, st.st_size),
+                    copy.deepcopy(config)
+                )
             except Exception as e:
                 print(f"❌ 保存 {username} 设备配置失败: {e}")
                 raise
@@ -242,8 +313,7 @@ class CGMManager:
         
         # 清除缓存
         cache_key = f"{username}_{device_id}"
-        if cache_key in self._provider_cache:
-            del self._provider_cache[cache_key]
+        self._provider_cache.pop(cache_key, None)
         
         # 返回时不包含加密凭证
         safe_device = {**new_device}
@@ -272,8 +342,7 @@ class CGMManager:
         
         # 清除缓存
         cache_key = f"{username}_{device_id}"
-        if cache_key in self._provider_cache:
-            del self._provider_cache[cache_key]
+        self._provider_cache.pop(cache_key, None)
         
         return True
     
@@ -317,19 +386,37 @@ class CGMManager:
         device_id: str, 
         credentials: dict
     ) -> bool:
-        """更新设备凭证"""
+        """
+        更新设备凭证
+        
+        凭证没有变化时直接返回，不重新加密也不写文件；
+        只改了非敏感字段（如 region）时沿用已加密的密码。
+        """
         config = self._load_user_config(username)
         devices = config.get("devices", [])
         
         for device in devices:
             if device["id"] == device_id:
-                device["credentials"] = _encrypt_credentials(credentials)
+                stored = device.get("credentials", {})
+                current = _decrypt_credentials(stored)
+                stored_password = stored.get("password")
+                plaintext = bool(stored_password) and not stored_password.startswith('gAAAAA')
+                if current == credentials and not plaintext:
+                    return True
+                
+                if stored_password and not plaintext and current.get("password") == credentials.get("password"):
+                    # 密码没变且已加密，只更新明文字段（旧版明文密码走下面重新加密）
+                    device["credentials"] = {
+                        **credentials,
+                        "password": stored_password
+                    }
+                else:
+                    device["credentials"] = _encrypt_credentials(credentials)
                 self._save_user_config(username, config)
                 
                 # 清除缓存
                 cache_key = f"{username}_{device_id}"
-                if cache_key in self._provider_cache:
-                    del self._provider_cache[cache_key]
+                self._provider_cache.pop(cache_key, None)
                 
                 return True
         
@@ -421,20 +508,26 @@ class CGMManager:
         if not target_device:
             return None
         
-        # 检查缓存
+        # 检查缓存（命中时不加锁）
         cache_key = f"{username}_{target_id}"
-        if cache_key in self._provider_cache:
-            return self._provider_cache[cache_key]
-        
-        # 创建 Provider
-        try:
-            decrypted_creds = _decrypt_credentials(target_device["credentials"])
-            provider = get_provider(target_device["type"], decrypted_creds)
-            self._provider_cache[cache_key] = provider
+        provider = self._provider_cache.get(cache_key)
+        if provider is not None:
             return provider
-        except Exception as e:
-            print(f"❌ 创建 Provider 失败 ({target_id}): {e}")
-            return None
+        
+        # 创建 Provider（加锁后再检查一次，避免并发请求各自创建）
+        with self._provider_lock:
+            provider = self._provider_cache.get(cache_key)
+            if provider is not None:
+                return provider
+            
+            try:
+                decrypted_creds = _decrypt_credentials(target_device["credentials"])
+                provider = get_provider(target_device["type"], decrypted_creds)
+                self._provider_cache[cache_key] = provider
+                return provider
+            except Exception as e:
+                print(f"❌ 创建 Provider 失败 ({target_id}): {e}")
+                return None
     
     def get_all_active_devices(self) -> List[dict]:
         """
@@ -452,42 +545,53 @@ class CGMManager:
                 "player_id": "amy_dexcom_001"  # 用于 API 的唯一标识
             }
         """
-        from passkey_auth import get_user_avatar, get_user_color, get_user
+        usernames = [filepath.stem for filepath in Path(CGM_DEVICES_DIR).glob("*.json")]
         
-        all_devices = []
+        # 缓存命中的用户直接处理，其余的放到线程池并发读取
+        cold = [u for u in usernames if not self._is_config_cached(u)]
+        loaded = dict(zip(cold, self._io_pool.map(self._collect_active_devices, cold)))
         
-        # 遍历所有用户配置文件
-        for filepath in Path(CGM_DEVICES_DIR).glob("*.json"):
-            username = filepath.stem
-            
-            try:
-                config = self._load_user_config(username)
-                devices = config.get("devices", [])
-                
-                # 获取用户级别的头像和颜色
-                user = get_user(username)
-                user_avatar = get_user_avatar(username)
-                user_color = get_user_color(username)
-                display_name = user.get("display_name", username) if user else username
-                
-                for device in devices:
-                    if device.get("is_active", True):
-                        all_devices.append({
-                            "username": username,
-                            "display_name": display_name,
-                            "device_id": device["id"],
-                            "device_name": device["name"],
-                            "device_type": device["type"],
-                            "avatar": user_avatar or "/static/images/default-avatar.png",
-                            "color": user_color,
-                            "player_id": f"{username}_{device['id']}"
-                        })
-            except Exception as e:
-                print(f"⚠️ 加载 {username} 设备失败: {e}")
-                continue
+        all_devices = []
+        for username in usernames:
+            if username in loaded:
+                all_devices.extend(loaded[username])
+            else:
+                all_devices.extend(self._collect_active_devices(username))
         
         return all_devices
     
+    def _collect_active_devices(self, username: str) -> List[dict]:
+        """收集单个用户的活跃设备（供 get_all_active_devices 使用）"""
+        from passkey_auth import get_user_avatar, get_user_color, get_user
+        
+        try:
+            config = self._load_user_config(username)
+            devices = config.get("devices", [])
+            
+            # 获取用户级别的头像和颜色
+            user = get_user(username)
+            user_avatar = get_user_avatar(username)
+            user_color = get_user_color(username)
+            display_name = user.get("display_name", username) if user else username
+            
+            return [
+                {
+                    "username": username,
+                    "display_name": display_name,
+                    "device_id": device["id"],
+                    "device_name": device["name"],
+                    "device_type": device["type"],
+                    "avatar": user_avatar or "/static/images/default-avatar.png",
+                    "color": user_color,
+                    "player_id": f"{username}_{device['id']}"
+                }
+                for device in devices
+                if device.get("is_active", True)
+            ]
+        except Exception as e:
+            print(f"⚠️ 加载 {username} 设备失败: {e}")
+            return []
+    
     def test_device_connection(self, username: str, device_id: str) -> dict:
         """测试设备连接"""
         provider = self.get_provider(username, device_id)
@@ -6,7 +6,7 @@ CGM Provider 基类
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 
 @dataclass
@@ -105,6 +105,18 @@ class BaseCGMProvider(ABC):
         """
         pass
     
+    def get_current_and_readings(self, minutes: int = 180,
+                                 max_count: int = 36) -> Tuple[Optional[CGMReading], List[CGMReading]]:
+        """
+        同时获取当前读数和历史读数（同步服务每个周期调用一次）
+        
+        默认分别请求两次；当前读数就是最新一条历史读数的设备可以重写为一次请求
+        
+        Returns:
+            (当前读数或 None, 历史读数列表)
+        """
+        return self.get_current_reading(), self.get_readings(minutes=minutes, max_count=max_count)
+    
     def test_connection(self) -> dict:
         """
         测试连接（用于添加设备时验证）
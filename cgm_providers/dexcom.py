@@ -3,7 +3,7 @@ Dexcom CGM Provider
 使用 pydexcom 库连接 Dexcom Share API
 """
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from .base import BaseCGMProvider, CGMReading
 
 
@@ -53,6 +53,19 @@ class DexcomProvider(BaseCGMProvider):
             # 为了安全起见，还是返回 False
             return False
     
+    @staticmethod
+    def _to_reading(reading) -> CGMReading:
+        """pydexcom 的 GlucoseReading -> CGMReading（带完整趋势信息）"""
+        return CGMReading(
+            value=reading.mmol_l,
+            value_mgdl=reading.value,
+            timestamp=reading.datetime,
+            trend=reading.trend,
+            trend_direction=reading.trend_direction,
+            trend_arrow=reading.trend_arrow,
+            trend_description=reading.trend_description,
+        )
+    
     def get_current_reading(self) -> Optional[CGMReading]:
         """获取当前血糖读数"""
         try:
@@ -62,15 +75,7 @@ class DexcomProvider(BaseCGMProvider):
             if reading is None:
                 return None
             
-            return CGMReading(
-                value=reading.mmol_l,
-                value_mgdl=reading.value,
-                timestamp=reading.datetime,
-                trend=reading.trend,
-                trend_direction=reading.trend_direction,
-                trend_arrow=reading.trend_arrow,
-                trend_description=reading.trend_description,
-            )
+            return self._to_reading(reading)
         except Exception as e:
             print(f"❌ Dexcom 获取当前读数失败: {e}")
             return None
@@ -94,3 +99,24 @@ class DexcomProvider(BaseCGMProvider):
         except Exception as e:
             print(f"❌ Dexcom 获取历史读数失败: {e}")
             return []
+    
+    def get_current_and_readings(self, minutes: int = 180,
+                                 max_count: int = 36) -> Tuple[Optional[CGMReading], List[CGMReading]]:
+        """
+        一次请求同时拿到当前读数和历史读数
+        
+        Dexcom Share 的"当前读数"就是最新一条历史读数（pydexcom 内部也是请求 max_count=1），
+        同步时不必为它单独再发一次 HTTPS 请求；历史为空（例如传感器中断超过 minutes）时再单独查询
+        """
+        try:
+            client = self._get_client()
+            readings = client.get_glucose_readings(minutes=minutes, max_count=max_count)
+        except Exception as e:
+            print(f"❌ Dexcom 获取历史读数失败: {e}")
+            return self.get_current_reading(), []
+        
+        if not readings:
+            return self.get_current_reading(), []
+        
+        result = [self._to_reading(reading) for reading in readings]
+        return result[0], result
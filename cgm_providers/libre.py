@@ -5,6 +5,9 @@ FreeStyle Libre CGM Provider
 安装: pip install pylibrelinkup
 """
 
+import time
+from functools import lru_cache
+from heapq import nlargest
 from typing import List, Optional
 from datetime import datetime
 from .base import BaseCGMProvider, CGMReading
@@ -25,6 +28,19 @@ LIBRE_REGIONS = {
     "la": "LA",
 }
 
+# 趋势数值映射
+TREND_MAP_INT = {
+    1: ("falling_fast", 1, "↓↓", "rapidly falling"),
+    2: ("falling", 2, "↓", "falling"),
+    3: ("stable", 3, "→", "stable"),
+    4: ("rising", 4, "↑", "rising"),
+    5: ("rising_fast", 5, "↑↑", "rapidly rising"),
+}
+UNKNOWN_TREND = ("unknown", None, "?", "unknown")
+
+# 认证有效期（秒）：期间内不再重复调用 authenticate()
+AUTH_TTL = 3000
+
 
 class LibreProvider(BaseCGMProvider):
     """FreeStyle Libre Provider (通过 LibreLinkUp)"""
@@ -36,6 +52,7 @@ class LibreProvider(BaseCGMProvider):
         super().__init__(credentials)
         self._client = None
         self._patient = None
+        self._auth_until = 0  # 认证有效期截止时间（time.monotonic）
     
     def _get_client(self):
         """获取或创建 LibreLinkUp 客户端"""
@@ -63,11 +80,15 @@ class LibreProvider(BaseCGMProvider):
         return self._client
     
     def _ensure_authenticated(self):
-        """确保已认证并获取患者"""
+        """确保已认证并获取患者（认证有效期内直接返回）"""
+        if self._patient is not None and time.monotonic() < self._auth_until:
+            return
+        
         client = self._get_client()
         
         # 调用 authenticate() 方法
         client.authenticate()
+        self._auth_until = time.monotonic() + AUTH_TTL
         
         if self._patient is None:
             # 获取关联的患者列表
@@ -116,34 +137,27 @@ class LibreProvider(BaseCGMProvider):
                 "message": f"连接失败: {str(e)}"
             }
     
-    def _convert_trend(self, trend_value) -> tuple:
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _convert_trend(trend_value) -> tuple:
         """
         转换 Libre 趋势值为标准格式
         
         pylibrelinkup 可能返回数值或字符串
         """
-        # 数值映射
-        trend_map_int = {
-            1: ("falling_fast", 1, "↓↓", "rapidly falling"),
-            2: ("falling", 2, "↓", "falling"),
-            3: ("stable", 3, "→", "stable"),
-            4: ("rising", 4, "↑", "rising"),
-            5: ("rising_fast", 5, "↑↑", "rapidly rising"),
-        }
-        
-        if isinstance(trend_value, int) and trend_value in trend_map_int:
-            return trend_map_int[trend_value]
+        if isinstance(trend_value, int) and trend_value in TREND_MAP_INT:
+            return TREND_MAP_INT[trend_value]
         
         # 尝试转换字符串
         if isinstance(trend_value, str):
             try:
                 trend_int = int(trend_value)
-                if trend_int in trend_map_int:
-                    return trend_map_int[trend_int]
+                if trend_int in TREND_MAP_INT:
+                    return TREND_MAP_INT[trend_int]
             except ValueError:
                 pass
         
-        return ("unknown", None, "?", "unknown")
+        return UNKNOWN_TREND
     
     def get_current_reading(self) -> Optional[CGMReading]:
         """获取当前血糖读数"""
@@ -178,6 +192,7 @@ class LibreProvider(BaseCGMProvider):
                 trend_description=desc,
             )
         except Exception as e:
+            self._auth_until = 0  # 请求失败后下次重新认证
             print(f"❌ Libre 获取当前读数失败: {e}")
             return None
     
@@ -193,27 +208,28 @@ class LibreProvider(BaseCGMProvider):
             if not history:
                 return []
             
-            result = []
-            for item in history[:max_count]:
-                value_mgdl = item.value
-                value_mmol = round(value_mgdl / 18.0, 1)
-                
-                # 获取时间戳
-                timestamp = getattr(item, 'timestamp', None) or \
-                           getattr(item, 'factory_timestamp', None) or \
-                           datetime.now()
-                
-                result.append(CGMReading(
-                    value=value_mmol,
-                    value_mgdl=int(value_mgdl),
-                    timestamp=timestamp,
+            # 缺少时间戳时统一使用同一个当前时间
+            now = datetime.now()
+            
+            def reading_time(item):
+                return getattr(item, 'timestamp', None) or \
+                       getattr(item, 'factory_timestamp', None) or \
+                       now
+            
+            # 直接取最新的 max_count 条（按时间降序），无需先全量排序
+            latest = nlargest(max_count, history, key=reading_time)
+            result = [
+                CGMReading(
+                    value=round(item.value / 18.0, 1),
+                    value_mgdl=int(item.value),
+                    timestamp=reading_time(item),
                     trend_arrow="→",  # 历史数据通常没有趋势
-                ))
-            
-            # 按时间降序排列
-            result.sort(key=lambda x: x.timestamp, reverse=True)
+                )
+                for item in latest
+            ]
             
             return result
         except Exception as e:
+            self._auth_until = 0  # 请求失败后下次重新认证
             print(f"❌ Libre 获取历史读数失败: {e}")
             return []
@@ -1,40 +1,134 @@
 """
 评论存储模块
 - 存储最近 20 条评论
-- 使用 JSON 文件持久化
+- 使用 JSONL 文件持久化（每条评论追加一行，定期压缩）
 - 支持多用户访问
 """
 
 import os
 import json
+import time
 import threading
+from collections import deque
 from datetime import datetime
 from typing import List, Optional
 
+# 可选：orjson 序列化更快，未安装时使用标准库 json
+try:
+    import orjson
+    
+    def _dumps_line(obj) -> bytes:
+        return orjson.dumps(obj) + b"\n"
+    
+    _loads = orjson.loads
+except ImportError:
+    def _dumps_line(obj) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+    
+    _loads = json.loads
+
 # 配置
-COMMENTS_FILE = os.path.join(os.path.dirname(__file__), ".comments.json")
+COMMENTS_FILE = os.path.join(os.path.dirname(__file__), ".comments.jsonl")
+LEGACY_COMMENTS_FILE = os.path.join(os.path.dirname(__file__), ".comments.json")  # 旧版整文件存储
 MAX_COMMENTS = 20
 MAX_COMMENT_LENGTH = 200  # 弹幕不宜太长
+COMPACT_THRESHOLD = MAX_COMMENTS * 5  # 文件超过这么多行时重写压缩
 
 # 线程锁，防止并发写入冲突
 _lock = threading.Lock()
 
+# 内存中的最近评论（读取直接使用，不再解析文件）
+_comments = deque(maxlen=MAX_COMMENTS)
 
-def _load_comments() -> List[dict]:
-    """加载评论数据"""
+# 文件状态：mtime/size 变化说明有其他进程写入，需要重新加载
+_cache = {"mtime": 0, "size": -1, "lines": 0}
+
+
+def _migrate_legacy():
+    """把旧版 .comments.json 转换为 JSONL（只执行一次）"""
     if os.path.exists(COMMENTS_FILE):
-        try:
-            with open(COMMENTS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return []
-    return []
+        return
+    try:
+        with open(LEGACY_COMMENTS_FILE, "rb") as f:
+            comments = _loads(f.read())
+    except (FileNotFoundError, ValueError, IOError):
+        return
+    if not isinstance(comments, list):
+        comments = []  # 内容不是列表视为损坏，按空评论处理
+    _save_comments(comments[-MAX_COMMENTS:])
+
+
+def _load_comments():
+    """从 JSONL 文件加载最近的评论到内存（调用方需持有 _lock）"""
+    _comments.clear()
+    lines = 0
+    try:
+        with open(COMMENTS_FILE, "rb") as f:
+            for line in f:
+                lines += 1
+                try:
+                    _comments.append(_loads(line))
+                except ValueError:
+                    continue  # 跳过写了一半的行
+    except (FileNotFoundError, IOError):
+        pass
+    _cache["lines"] = lines
+
+
+def _refresh():
+    """文件被修改过（包括其他进程追加）时重新加载（调用方需持有 _lock）"""
+    try:
+        st = os.stat(COMMENTS_FILE)
+        signature = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        signature = (0, -1)
+    
+    if signature != (_cache["mtime"], _cache["size"]):
+        _load_comments()
+        _cache["mtime"], _cache["size"] = signature
+
+
+def _append_comment(comment: dict):
+    """
+    追加一条评论到文件末尾（单次 write，不读取、不截断）
+    
+    只有本次写入正好接在已缓存内容之后时才推进缓存状态；
+    期间其他进程追加过评论时让缓存失效，下次读取重新加载，不会漏掉它们
+    """
+    line = _dumps_line(comment)
+    fd = os.open(COMMENTS_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+        # O_APPEND 写入后文件位置就是本次写入的末尾
+        end = os.lseek(fd, 0, os.SEEK_CUR)
+        st = os.fstat(fd)
+    finally:
+        os.close(fd)
+    
+    if end - len(line) == max(_cache["size"], 0):
+        _cache["mtime"], _cache["size"] = st.st_mtime_ns, end
+        _cache["lines"] += 1
+    else:
+        _cache["mtime"], _cache["size"] = 0, -1
 
 
 def _save_comments(comments: List[dict]):
-    """保存评论数据"""
-    with open(COMMENTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(comments, f, ensure_ascii=False, indent=2)
+    """重写整个评论文件（迁移 / 压缩 / 清空时使用），同时更新内存数据"""
+    # 先写临时文件再原子替换，写到一半崩溃也不会损坏已有评论
+    # 临时文件名带上进程号，多个 worker 同时压缩时不会写到同一个临时文件
+    # 文件状态在替换前从临时文件取得（rename 不改变 mtime / 大小），替换后其他进程的写入不会被算进来
+    tmp_file = f"{COMMENTS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(b"".join(_dumps_line(comment) for comment in comments))
+        f.flush()
+        st = os.fstat(f.fileno())
+    os.replace(tmp_file, COMMENTS_FILE)
+    
+    _comments.clear()
+    _comments.extend(comments)
+    
+    _cache["mtime"], _cache["size"] = st.st_mtime_ns, st.st_size
+    _cache["lines"] = len(comments)
 
 
 def add_comment(username: str, content: str, avatar: Optional[str] = None) -> dict:
@@ -57,24 +151,24 @@ def add_comment(username: str, content: str, avatar: Optional[str] = None) -> di
         raise ValueError("用户名和评论内容不能为空")
     
     # 创建评论对象
+    now = datetime.now()
     comment = {
-        "id": int(datetime.now().timestamp() * 1000),  # 毫秒时间戳作为 ID
+        "id": time.time_ns() // 1_000_000,  # 毫秒时间戳作为 ID
         "username": username,
         "content": content,
         "avatar": avatar or username[0].upper(),
-        "timestamp": datetime.now().isoformat(),
-        "created_at": datetime.now().strftime("%H:%M")
+        "timestamp": now.isoformat(),
+        "created_at": now.strftime("%H:%M")
     }
     
     with _lock:
-        comments = _load_comments()
-        comments.append(comment)
-        
-        # 只保留最近 20 条
-        if len(comments) > MAX_COMMENTS:
-            comments = comments[-MAX_COMMENTS:]
+        _refresh()
+        _comments.append(comment)  # deque 自动只保留最近 20 条
+        _append_comment(comment)
         
-        _save_comments(comments)
+        # 文件行数过多时压缩为最近 20 条
+        if _cache["lines"] > COMPACT_THRESHOLD:
+            _save_comments(list(_comments))
     
     return comment
 
@@ -89,21 +183,36 @@ def get_comments(since_id: Optional[int] = None) -> List[dict]:
     Returns:
         评论列表
     """
-    comments = _load_comments()
-    
-    if since_id:
-        comments = [c for c in comments if c["id"] > since_id]
-    
-    return comments
+    with _lock:
+        _refresh()
+        if since_id:
+            return [c for c in _comments if c["id"] > since_id]
+        return list(_comments)
 
 
 def get_latest_comments(count: int = 20) -> List[dict]:
     """获取最近 N 条评论"""
-    comments = _load_comments()
-    return comments[-count:]
+    with _lock:
+        _refresh()
+        return list(_comments)[-count:]
+
+
+def get_comments_version() -> str:
+    """
+    获取评论数据的版本号（文件 mtime + 大小），用于 HTTP ETag
+    
+    评论有变化时版本号一定变化
+    """
+    with _lock:
+        _refresh()
+        return f"{_cache['mtime']}-{_cache['size']}"
 
 
 def clear_comments():
     """清空所有评论（管理功能）"""
     with _lock:
         _save_comments([])
+
+
+# 启动时迁移旧格式
+_migrate_legacy()
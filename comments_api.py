@@ -3,13 +3,37 @@
 添加到 Flask app 中使用
 """
 
-from flask import Blueprint, jsonify, request, session
-from comments import add_comment, get_comments, get_latest_comments
+import json
+
+from flask import Blueprint, current_app, jsonify, request, session
+from comments import add_comment, get_comments, get_latest_comments, get_comments_version
+
+# 可选：orjson 序列化更快，未安装时使用 Flask 的 jsonify
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 创建 Blueprint
 comments_bp = Blueprint('comments', __name__, url_prefix='/api/comments')
 
 
+def _json_response(payload: dict):
+    """生成 JSON 响应（优先使用 orjson）"""
+    if orjson is None:
+        return jsonify(payload)
+    return current_app.response_class(orjson.dumps(payload), mimetype="application/json")
+
+
+def _ndjson_response(items: list):
+    """生成 NDJSON 响应（每行一个 JSON 对象）"""
+    if orjson is None:
+        body = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode("utf-8")
+    else:
+        body = b"".join(orjson.dumps(item) + b"\n" for item in items)
+    return current_app.response_class(body, mimetype="application/x-ndjson")
+
+
 @comments_bp.route('', methods=['GET'])
 def api_get_comments():
     """
@@ -18,20 +42,37 @@ def api_get_comments():
     Query params:
         since_id: 可选，只返回此 ID 之后的评论
         count: 可选，返回数量（默认 20）
+    
+    带 since_id 的增量轮询返回 NDJSON（每行一条评论），没有新评论时返回 204；
+    否则返回完整 JSON。
+    
+    支持 ETag：评论没有变化时返回 304，不再重复序列化
     """
+    # 先取版本号再读数据：即使期间有新评论，最多导致下次多返回一次 200
+    etag = get_comments_version()
+    if request.if_none_match.contains_weak(etag):
+        return "", 304, {"ETag": f'W/"{etag}"', "Cache-Control": "no-cache"}
+    
     since_id = request.args.get('since_id', type=int)
     count = request.args.get('count', default=20, type=int)
     
     if since_id:
         comments = get_comments(since_id=since_id)
+        if comments:
+            response = _ndjson_response(comments)
+        else:
+            response = current_app.response_class(status=204)
     else:
         comments = get_latest_comments(count=min(count, 20))
+        response = _json_response({
+            "success": True,
+            "comments": comments,
+            "count": len(comments)
+        })
     
-    return jsonify({
-        "success": True,
-        "comments": comments,
-        "count": len(comments)
-    })
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @comments_bp.route('', methods=['POST'])
@@ -68,7 +109,7 @@ def api_add_comment():
     
     try:
         comment = add_comment(username, content, avatar)
-        return jsonify({
+        return _json_response({
             "success": True,
             "comment": comment
         })
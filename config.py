@@ -5,11 +5,23 @@
 
 import os
 import re
+import logging
+from collections import defaultdict
 from dotenv import load_dotenv
 
 # 加载 .env 文件
 load_dotenv()
 
+# 日志（级别可通过 LOG_LEVEL 环境变量调整，默认 INFO；无效的值回退到 INFO，不让导入失败）
+_log_level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").strip().upper(), None)
+logging.basicConfig(level=_log_level if isinstance(_log_level, int) else logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+if not isinstance(_log_level, int):
+    logger.warning("⚠️ 无效的 LOG_LEVEL=%s，使用 INFO", os.getenv("LOG_LEVEL"))
+
+# 用户配置环境变量: USER_<ID>_<FIELD>
+_USER_ENV_PATTERN = re.compile(r'^USER_(\d+)_(.+)$')
+
 
 def _get_env(key: str, default: str = None) -> str:
     """获取环境变量"""
@@ -27,7 +39,7 @@ def _decrypt_if_needed(value: str) -> str:
             from password_manager import EncryptedBackend
             return EncryptedBackend.decrypt(value)
         except Exception as e:
-            print(f"⚠️  密码解密失败: {e}")
+            logger.warning("⚠️  密码解密失败: %s", e)
             return value
     
     return value
@@ -43,7 +55,7 @@ def _get_password_from_keyring(user_id: str) -> str:
     except ImportError:
         pass
     except Exception as e:
-        print(f"⚠️  从 Keyring 读取密码失败: {e}")
+        logger.warning("⚠️  从 Keyring 读取密码失败: %s", e)
     return None
 
 
@@ -54,57 +66,62 @@ def _load_users_from_env() -> dict:
     """
     users = {}
     
-    # 查找所有 USER_*_NAME 来确定有哪些用户
-    user_pattern = re.compile(r'^USER_(\d+)_NAME$')
-    
-    for key in os.environ:
-        match = user_pattern.match(key)
+    # 一次遍历 os.environ，按用户编号分组所有 USER_<ID>_<FIELD>
+    grouped = defaultdict(dict)
+    for key, value in os.environ.items():
+        match = _USER_ENV_PATTERN.match(key)
         if match:
-            user_num = match.group(1)
-            user_id = f"user{user_num}"
-            
-            # 获取该用户的所有配置
-            name = _get_env(f"USER_{user_num}_NAME")
-            username = _get_env(f"USER_{user_num}_USERNAME")
-            
-            # 获取密码（优先级：Keyring > 加密密码 > 明文密码）
-            password = None
-            
-            # 1. 先尝试 Keyring
-            password = _get_password_from_keyring(user_id)
-            
-            # 2. 再尝试 .env 中的加密密码
-            if not password:
-                password_encrypted = _get_env(f"USER_{user_num}_PASSWORD_ENCRYPTED")
-                if password_encrypted:
-                    password = _decrypt_if_needed(password_encrypted)
-            
-            # 3. 最后尝试明文密码（不推荐）
-            if not password:
-                password_plain = _get_env(f"USER_{user_num}_PASSWORD")
-                if password_plain:
-                    print(f"⚠️  用户 {name} 使用明文密码，建议使用 Keyring 或加密密码")
-                    password = password_plain
-            
-            region = _get_env(f"USER_{user_num}_REGION", "ous")
-            avatar = _get_env(f"USER_{user_num}_AVATAR", f"images/avatar{user_num}.svg")
-            color = _get_env(f"USER_{user_num}_COLOR", "#0077BB")
-            
-            if name and username and password:
-                users[user_id] = {
-                    "name": name,
-                    "username": username,
-                    "password": password,
-                    "region": region,
-                    "avatar": avatar,
-                    "color": color,
-                }
-            else:
-                missing = []
-                if not name: missing.append("NAME")
-                if not username: missing.append("USERNAME")
-                if not password: missing.append("PASSWORD")
-                print(f"⚠️  用户 {user_num} 配置不完整，缺少: {', '.join(missing)}")
+            grouped[match.group(1)][match.group(2)] = value
+    
+    for user_num, fields in grouped.items():
+        # 以 USER_<ID>_NAME 确定有哪些用户
+        if "NAME" not in fields:
+            continue
+        
+        user_id = f"user{user_num}"
+        
+        # 获取该用户的所有配置
+        name = fields.get("NAME")
+        username = fields.get("USERNAME")
+        
+        # 获取密码（优先级：Keyring > 加密密码 > 明文密码）
+        password = None
+        
+        # 1. 先尝试 Keyring
+        password = _get_password_from_keyring(user_id)
+        
+        # 2. 再尝试 .env 中的加密密码
+        if not password:
+            password_encrypted = fields.get("PASSWORD_ENCRYPTED")
+            if password_encrypted:
+                password = _decrypt_if_needed(password_encrypted)
+        
+        # 3. 最后尝试明文密码（不推荐）
+        if not password:
+            password_plain = fields.get("PASSWORD")
+            if password_plain:
+                logger.warning("⚠️  用户 %s 使用明文密码，建议使用 Keyring 或加密密码", name)
+                password = password_plain
+        
+        region = fields.get("REGION", "ous")
+        avatar = fields.get("AVATAR", f"images/avatar{user_num}.svg")
+        color = fields.get("COLOR", "#0077BB")
+        
+        if name and username and password:
+            users[user_id] = {
+                "name": name,
+                "username": username,
+                "password": password,
+                "region": region,
+                "avatar": avatar,
+                "color": color,
+            }
+        else:
+            missing = []
+            if not name: missing.append("NAME")
+            if not username: missing.append("USERNAME")
+            if not password: missing.append("PASSWORD")
+            logger.warning("⚠️  用户 %s 配置不完整，缺少: %s", user_num, ", ".join(missing))
     
     return users
 
@@ -115,13 +132,13 @@ def _load_users_from_env() -> dict:
 USERS = _load_users_from_env()
 
 if not USERS:
-    print("=" * 50)
-    print("⚠️  未找到用户配置！")
-    print("请按以下步骤配置：")
-    print("1. 复制 .env.example 为 .env")
-    print("2. 运行 python crypto_utils.py 加密密码")
-    print("3. 将加密后的密码填入 .env")
-    print("=" * 50)
+    logger.warning(
+        "%s\n⚠️  未找到用户配置！\n请按以下步骤配置：\n"
+        "1. 复制 .env.example 为 .env\n"
+        "2. 运行 python crypto_utils.py 加密密码\n"
+        "3. 将加密后的密码填入 .env\n%s",
+        "=" * 50, "=" * 50,
+    )
     
     # 提供默认演示用户（无真实凭据）
     # USERS = {
@@ -144,7 +161,19 @@ if not USERS:
     # }
 
 # 打印加载的用户（不显示敏感信息）
-print(f"✅ 已加载 {len(USERS)} 个用户: {', '.join(u['name'] for u in USERS.values())}")
+if logger.isEnabledFor(logging.INFO):
+    logger.info("✅ 已加载 %d 个用户: %s", len(USERS), ", ".join(u["name"] for u in USERS.values()))
+
+# 用户公开信息列表（USERS 加载后不再变化，预先生成供接口直接返回）
+USER_LIST = tuple(
+    {
+        "id": user_id,
+        "name": info["name"],
+        "avatar": info["avatar"],
+        "color": info["color"],
+    }
+    for user_id, info in USERS.items()
+)
 
 
 # ==================== 其他配置 ====================
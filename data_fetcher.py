@@ -11,50 +11,91 @@ player_id 格式：{username}_{device_id}
 例如：amy_dexcom_001
 """
 
-from datetime import datetime, timedelta
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
 from typing import Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import threading
+import time
 
-from cgm_manager import cgm_manager
+from cgm_manager import cgm_manager, parse_player_id as _parse_player_id
+from cgm_providers.base import CGMReading
+
+logger = logging.getLogger(__name__)
 
 # 尝试导入同步服务
 try:
     from sync_service import (
         get_current_from_local,
         get_history_from_local,
-        load_player_data
+        load_player_data,
+        sync_player_data
     )
-    SYNC_SERVICE_AVAILABLE = True
 except ImportError:
-    SYNC_SERVICE_AVAILABLE = False
-    print("⚠️ sync_service 未找到，将直接调用 CGM API")
-
-
-def _parse_player_id(player_id: str) -> tuple:
-    """
-    解析 player_id 为 (username, device_id)
+    logger.warning("⚠️ sync_service 未找到，将直接调用 CGM API")
     
-    player_id 格式: {username}_{device_type}_{uuid}
-    例如: amy_dexcom_abc12345
+    # 空实现：本地永远没有数据，直接走 Provider API
+    def get_current_from_local(player_id: str) -> Optional[dict]:
+        return None
     
-    注意：username 可能包含下划线，但 device_id 的格式是固定的 {type}_{uuid}
-    """
-    if not player_id or "_" not in player_id:
-        return None, None
+    def get_history_from_local(player_id: str, minutes: int = 180, max_count: int = 36) -> list:
+        return []
     
-    # 从右边找，因为 device_id 格式固定
-    parts = player_id.rsplit("_", 2)
+    def load_player_data(player_id: str) -> dict:
+        return {}
     
-    if len(parts) >= 3:
-        # 正常情况：username_devicetype_uuid
-        username = "_".join(parts[:-2]) if len(parts) > 3 else parts[0]
-        device_id = f"{parts[-2]}_{parts[-1]}"
-        return username, device_id
-    elif len(parts) == 2:
-        # 可能是简单格式：username_deviceid
-        return parts[0], parts[1]
+    def sync_player_data(player_id: str, warmup: bool = False) -> bool:
+        return False
+
+
+# 并发拉取多个玩家数据的线程池（模块级复用，避免每次请求创建线程）
+# 任务以网络 / 磁盘 I/O 为主，线程数按 CPU 数放大，上限 16
+FETCH_WORKERS = min(16, (os.cpu_count() or 4) * 4)
+_fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="glucose-fetch")
+
+# 找不到设备信息时使用的默认显示
+DEFAULT_PLAYER_DISPLAY = {"avatar": "🩸", "color": "#666"}
+
+# 活跃设备列表短暂缓存（同一次页面刷新里玩家列表和血糖接口会先后调用）
+ACTIVE_DEVICES_TTL = 2.0  # 秒
+_active_devices_cache = {"ts": 0.0, "data": []}
+
+# 玩家显示信息缓存（设备名称 / 头像 / 颜色很少变化）
+PLAYER_INFO_TTL = 60  # 秒
+PLAYER_INFO_CACHE_SIZE = 1024
+_player_info_cache: "OrderedDict[str, tuple]" = OrderedDict()  # player_id -> (写入时间, 信息)
+_player_info_lock = threading.Lock()
+
+# 当前血糖结果缓存（CGM 每 5 分钟才更新一次，多个页面轮询时复用结果）
+CURRENT_CACHE_TTL = 30  # 秒
+CURRENT_ERROR_CACHE_TTL = 5  # 秒：失败结果只短暂缓存，Provider 恢复后尽快重试
+CURRENT_WAIT_TIMEOUT = 15  # 秒：等待其他线程读取的上限，超时后自己读取，避免 Provider 卡住时所有请求一起挂起
+_current_cache: Dict[str, tuple] = {}         # player_id -> (过期时间, 结果)
+_current_inflight: Dict[str, threading.Event] = {}  # player_id -> 正在进行的读取
+_current_lock = threading.Lock()
+
+# 本地数据新鲜度（分钟）：SOFT 内直接使用；SOFT ~ HARD 之间先返回旧数据并在后台刷新
+LOCAL_SOFT_TTL_MINUTES = 10
+LOCAL_HARD_TTL_MINUTES = 30
+
+# 后台刷新本地数据的线程池（同一玩家同时只刷新一次）
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="glucose-refresh")
+_refreshing: set = set()
+_refreshing_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso(value: str) -> float:
+    """
+    解析 ISO 时间字符串为 epoch 秒
     
-    return None, None
+    同一个 last_updated 在两次同步之间会被反复解析，缓存结果
+    """
+    return datetime.fromisoformat(value).timestamp()
 
 
 def _is_data_fresh(last_updated_str: str, max_age_minutes: int = 10) -> bool:
@@ -63,102 +104,192 @@ def _is_data_fresh(last_updated_str: str, max_age_minutes: int = 10) -> bool:
         return False
     
     try:
-        last_updated = datetime.fromisoformat(last_updated_str)
-        age = datetime.now() - last_updated
-        return age < timedelta(minutes=max_age_minutes)
-    except:
+        return time.time() - _parse_iso(last_updated_str) < max_age_minutes * 60
+    except (TypeError, ValueError):
         return False
 
 
-def _get_player_info(player_id: str) -> dict:
-    """获取玩家信息（从 CGM Manager）"""
-    username, device_id = _parse_player_id(player_id)
-    if not username or not device_id:
-        return {
-            "user_id": player_id,
-            "user_name": player_id,
-            "avatar": "🩸",
-            "color": "#666"
-        }
+def _active_devices() -> list:
+    """获取活跃设备列表（缓存 ACTIVE_DEVICES_TTL 秒，返回值只读）"""
+    now = time.monotonic()
+    if now - _active_devices_cache["ts"] > ACTIVE_DEVICES_TTL:
+        _active_devices_cache.update(ts=now, data=cgm_manager.get_all_active_devices())
+    return _active_devices_cache["data"]
+
+
+def _get_player_info(player_id: str, username: str = None, device_id: str = None) -> dict:
+    """
+    获取玩家信息（从 CGM Manager，缓存 PLAYER_INFO_TTL 秒）
     
-    device = cgm_manager.get_device(username, device_id)
-    if device:
-        return {
-            "user_id": player_id,
-            "user_name": device.get("name", player_id),
-            "avatar": device.get("display", {}).get("avatar", "🩸"),
-            "color": device.get("display", {}).get("color", "#666")
-        }
+    调用方已解析过 player_id 时传入 username / device_id，避免重复解析
+    """
+    now = time.monotonic()
+    with _player_info_lock:
+        cached = _player_info_cache.get(player_id)
+        if cached and now - cached[0] < PLAYER_INFO_TTL:
+            return cached[1]
+    
+    if username is None and device_id is None:
+        username, device_id = _parse_player_id(player_id)
+    info = _lookup_player_info(player_id, username, device_id)
+    
+    with _player_info_lock:
+        _player_info_cache[player_id] = (now, info)
+        _player_info_cache.move_to_end(player_id)
+        if len(_player_info_cache) > PLAYER_INFO_CACHE_SIZE:
+            _player_info_cache.popitem(last=False)  # 淘汰最早加入的
+    return info
+
+
+def _lookup_player_info(player_id: str, username: str, device_id: str) -> dict:
+    """从 CGM Manager 查询设备显示信息"""
+    device = cgm_manager.get_device(username, device_id) if username and device_id else None
+    
+    if not device:
+        return {"user_id": player_id, "user_name": player_id, **DEFAULT_PLAYER_DISPLAY}
     
+    display = device.get("display") or DEFAULT_PLAYER_DISPLAY
     return {
         "user_id": player_id,
-        "user_name": player_id,
-        "avatar": "🩸",
-        "color": "#666"
+        "user_name": device.get("name", player_id),
+        "avatar": display.get("avatar", DEFAULT_PLAYER_DISPLAY["avatar"]),
+        "color": display.get("color", DEFAULT_PLAYER_DISPLAY["color"])
     }
 
 
+def _background_refresh(player_id: str):
+    """后台从 Provider 同步玩家数据到本地"""
+    try:
+        if sync_player_data(player_id):
+            with _current_lock:
+                _current_cache.pop(player_id, None)  # 让下次读取拿到新数据
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(player_id)
+
+
+def _schedule_refresh(player_id: str):
+    """提交后台刷新（同一玩家已在刷新时跳过）"""
+    with _refreshing_lock:
+        if player_id in _refreshing:
+            return
+        _refreshing.add(player_id)
+    _refresh_pool.submit(_background_refresh, player_id)
+
+
+def _get_fallback_provider(username: Optional[str], device_id: Optional[str]) -> tuple:
+    """
+    获取 Fallback 用的 Provider
+    
+    Returns:
+        (provider, None)，无法获取时返回 (None, 错误信息)
+    """
+    if not (username and device_id):
+        return None, "无效的玩家 ID"
+    
+    provider = cgm_manager.get_provider(username, device_id)
+    if not provider:
+        return None, "未找到 CGM 设备"
+    return provider, None
+
+
 def get_current_glucose(player_id: str) -> dict:
     """
     获取指定玩家的当前血糖数据
     
+    结果缓存 CURRENT_CACHE_TTL 秒（失败结果只缓存 CURRENT_ERROR_CACHE_TTL 秒）；
+    同一玩家的并发请求只触发一次实际读取，其他请求最多等待 CURRENT_WAIT_TIMEOUT 秒
+    并复用该结果。返回值为共享对象，调用方不要修改。
+    
     Args:
         player_id: 玩家 ID（格式：{username}_{device_id}）
     
     Returns:
         血糖数据字典（血糖值使用 mmol/L 单位）
     """
-    player_info = _get_player_info(player_id)
+    with _current_lock:
+        cached = _current_cache.get(player_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        event = _current_inflight.get(player_id)
+        is_leader = event is None
+        if is_leader:
+            event = _current_inflight[player_id] = threading.Event()
+    
+    if not is_leader:
+        # 已有线程在读取，等待它的结果
+        if event.wait(CURRENT_WAIT_TIMEOUT):
+            with _current_lock:
+                cached = _current_cache.get(player_id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+        # 等待超时或读取线程异常退出，自己再读一次
+        return _fetch_current_glucose(player_id)
+    
+    try:
+        result = _fetch_current_glucose(player_id)
+        ttl = CURRENT_CACHE_TTL if result.get("success") else CURRENT_ERROR_CACHE_TTL
+        with _current_lock:
+            _current_cache[player_id] = (time.monotonic() + ttl, result)
+        return result
+    finally:
+        with _current_lock:
+            _current_inflight.pop(player_id, None)
+        event.set()
+
+
+def _fetch_current_glucose(player_id: str) -> dict:
+    """实际读取玩家当前血糖（本地文件优先，Fallback 到 Provider API）"""
     username, device_id = _parse_player_id(player_id)
+    player_info = _get_player_info(player_id, username, device_id)
     
     # 1. 尝试从本地读取
-    if SYNC_SERVICE_AVAILABLE:
-        try:
-            local_data = load_player_data(player_id)
-            current = local_data.get("current")
-            
-            # 检查数据是否存在且新鲜（10分钟内）
-            if current and _is_data_fresh(local_data.get("last_updated"), 10):
-                return {
-                    "success": True,
-                    **player_info,
-                    "data": current,
-                    "source": "local"
-                }
-        except Exception as e:
-            print(f"⚠️ 从本地读取 {player_id} 失败: {e}")
-    
-    # 2. Fallback: 直接调用 Provider API
-    if username and device_id:
-        try:
-            provider = cgm_manager.get_provider(username, device_id)
-            if provider:
-                reading = provider.get_current_reading()
-                
-                if reading:
-                    return {
-                        "success": True,
-                        **player_info,
-                        "data": reading.to_dict(),
-                        "source": "api"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        **player_info,
-                        "error": "暂无数据"
-                    }
-        except Exception as e:
+    try:
+        local_data = load_player_data(player_id)
+        current = local_data.get("current")
+        
+        last_updated = local_data.get("last_updated")
+        
+        # 检查数据是否存在且新鲜（10分钟内）
+        if current and _is_data_fresh(last_updated, LOCAL_SOFT_TTL_MINUTES):
+            return {
+                "success": True,
+                **player_info,
+                "data": current,
+                "source": "local"
+            }
+        
+        # 稍旧的数据：先返回，后台刷新（stale-while-revalidate）
+        if current and _is_data_fresh(last_updated, LOCAL_HARD_TTL_MINUTES):
+            _schedule_refresh(player_id)
             return {
-                "success": False,
+                "success": True,
                 **player_info,
-                "error": str(e)
+                "data": current,
+                "source": "local-stale"
             }
+    except Exception as e:
+        logger.warning("⚠️ 从本地读取 %s 失败: %s", player_id, e)
+    
+    # 2. Fallback: 直接调用 Provider API
+    provider, error = _get_fallback_provider(username, device_id)
+    if error:
+        return {"success": False, **player_info, "error": error}
+    
+    try:
+        reading = provider.get_current_reading()
+    except Exception as e:
+        return {"success": False, **player_info, "error": str(e)}
+    
+    if not reading:
+        return {"success": False, **player_info, "error": "暂无数据"}
     
     return {
-        "success": False,
+        "success": True,
         **player_info,
-        "error": "无效的玩家 ID"
+        "data": reading.to_dict(),
+        "source": "api"
     }
 
 
@@ -174,50 +305,38 @@ def get_glucose_history(player_id: str, minutes: int = 180, max_count: int = 36)
     Returns:
         历史数据字典（血糖值使用 mmol/L 单位）
     """
-    player_info = _get_player_info(player_id)
     username, device_id = _parse_player_id(player_id)
+    player_info = _get_player_info(player_id, username, device_id)
     
     # 1. 尝试从本地读取
-    if SYNC_SERVICE_AVAILABLE:
-        try:
-            history = get_history_from_local(player_id, minutes, max_count)
-            
-            if history:
-                return {
-                    "success": True,
-                    **player_info,
-                    "history": history,
-                    "source": "local"
-                }
-        except Exception as e:
-            print(f"⚠️ 从本地读取 {player_id} 历史失败: {e}")
-    
-    # 2. Fallback: 直接调用 Provider API
-    if username and device_id:
-        try:
-            provider = cgm_manager.get_provider(username, device_id)
-            if provider:
-                readings = provider.get_readings(minutes=minutes, max_count=max_count)
-                
-                data = [r.to_dict() for r in readings]
-                
-                return {
-                    "success": True,
-                    **player_info,
-                    "history": data,
-                    "source": "api"
-                }
-        except Exception as e:
+    try:
+        history = get_history_from_local(player_id, minutes, max_count)
+        
+        if history:
             return {
-                "success": False,
+                "success": True,
                 **player_info,
-                "error": str(e)
+                "history": history,
+                "source": "local"
             }
+    except Exception as e:
+        logger.warning("⚠️ 从本地读取 %s 历史失败: %s", player_id, e)
+    
+    # 2. Fallback: 直接调用 Provider API
+    provider, error = _get_fallback_provider(username, device_id)
+    if error:
+        return {"success": False, **player_info, "error": error}
+    
+    try:
+        readings = provider.get_readings(minutes=minutes, max_count=max_count)
+    except Exception as e:
+        return {"success": False, **player_info, "error": str(e)}
     
     return {
-        "success": False,
+        "success": True,
         **player_info,
-        "error": "无效的玩家 ID"
+        "history": list(map(CGMReading.to_dict, readings)),
+        "source": "api"
     }
 
 
@@ -225,20 +344,46 @@ def get_all_players_glucose() -> list:
     """
     获取所有活跃玩家的当前血糖数据（用于 PK）
     
+    各玩家的读取（本地文件或 Provider 网络请求）互相独立，
+    放到线程池中并发执行，总耗时约等于最慢的一个玩家。
+    get_current_glucose 只读共享状态（结果缓存有锁保护），可以安全地并发调用。
+    
     Returns:
-        所有玩家的血糖数据列表
+        所有玩家的血糖数据列表（顺序与活跃设备列表一致）
     """
-    results = []
-    
     # 从 CGM Manager 获取所有活跃设备
-    all_devices = cgm_manager.get_all_active_devices()
+    all_devices = _active_devices()
+    player_ids = [device["player_id"] for device in all_devices]
+    
+    return list(_fetch_pool.map(get_current_glucose, player_ids))
+
+
+# ==================== 异步接口 ====================
+# Provider 底层使用的 pydexcom / pylibrelinkup 都是同步库，
+# 异步接口把阻塞调用放到 _fetch_pool 中执行，供 asyncio 调用方使用
+
+# 异步接口同时进行的读取上限
+ASYNC_CONCURRENCY = 32
+
+
+async def aget_current_glucose(player_id: str) -> dict:
+    """get_current_glucose 的异步版本"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_fetch_pool, get_current_glucose, player_id)
+
+
+async def aget_all_players_glucose() -> list:
+    """get_all_players_glucose 的异步版本（顺序与活跃设备列表一致）"""
+    loop = asyncio.get_running_loop()
+    all_devices = await loop.run_in_executor(_fetch_pool, _active_devices)
+    
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
     
-    for device in all_devices:
-        player_id = device["player_id"]
-        result = get_current_glucose(player_id)
-        results.append(result)
+    async def fetch(player_id: str) -> dict:
+        async with semaphore:
+            return await aget_current_glucose(player_id)
     
-    return results
+    return list(await asyncio.gather(*(fetch(device["player_id"]) for device in all_devices)))
 
 
 def get_player_list() -> list:
@@ -248,7 +393,7 @@ def get_player_list() -> list:
     Returns:
         玩家信息列表
     """
-    all_devices = cgm_manager.get_all_active_devices()
+    all_devices = _active_devices()
     
     return [
         {
@@ -37,18 +37,20 @@ for func in functions:
     else:
         print(f"❌ {func} - 缺失")
 
-# 4. 检查用户数据文件
-if os.path.exists('.passkey_users.json'):
-    print("\n✅ 用户数据文件存在")
+# 4. 检查用户数据目录
+if os.path.isdir('.passkey_users'):
+    print("\n✅ 用户数据目录存在")
     import json
     try:
-        with open('.passkey_users.json', 'r') as f:
-            users = json.load(f)
-        print(f"   用户数量: {len(users)}")
-        for username in users.keys():
-            print(f"   - {username}")
+        user_files = [f for f in os.listdir('.passkey_users') if f.endswith('.json')]
+        print(f"   用户数量: {len(user_files)}")
+        for filename in user_files:
+            with open(os.path.join('.passkey_users', filename), 'r') as f:
+                print(f"   - {json.load(f)['username']}")
     except Exception as e:
         print(f"   ⚠️ 读取用户数据失败: {e}")
+elif os.path.exists('.passkey_users.json'):
+    print("\n⚠️ 发现旧版用户数据文件，启动应用后会自动迁移到 .passkey_users/")
 else:
     print("\n⚠️ 用户数据文件不存在（首次使用正常）")
 
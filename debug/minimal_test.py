@@ -13,7 +13,7 @@ print("="*60)
 # 步骤 1: 检查文件
 print("\n步骤 1: 检查文件")
 print("-"*60)
-files_to_check = ['passkey_auth.py', '.passkey_users.json']
+files_to_check = ['passkey_auth.py', '.passkey_users']
 for f in files_to_check:
     if os.path.exists(f):
         print(f"✅ {f} 存在")
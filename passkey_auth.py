@@ -8,31 +8,74 @@ Passkey (WebAuthn) 认证模块 - 改进版
 """
 
 import os
+import re
+import base64
+import importlib.util
+import atexit
+import copy
 import json
 import secrets
+import hmac
 import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
+from urllib.parse import quote
+
+# 可选：orjson 解析 / 序列化更快，未安装时使用标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选：POSIX 上用 flock 做跨进程的用户文件写入锁（Windows 上只有进程内的线程锁）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 可选：配置 REDIS_URL 时挑战存到 Redis（多 worker / 多实例共享）
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# argon2 是必需依赖：缺失时不能抛 ImportError，否则 app.py 会把它当成"未安装 Passkey"
+# 而关闭认证（所有请求直接放行），这里改为 RuntimeError 让启动直接失败
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError as e:
+    raise RuntimeError("缺少 argon2-cffi，无法校验登录密码，请执行 pip install argon2-cffi") from e
+
+# webauthn 较重（会连带加载 cryptography / cbor2 等），只在 Passkey 流程函数里按需导入；
+# 这里只检查是否已安装，未安装时导入本模块仍然失败（app.py 据此禁用 Passkey）
+if importlib.util.find_spec("webauthn") is None:
+    raise ImportError("No module named 'webauthn'")
+
+
+def bytes_to_base64url(val: bytes) -> str:
+    """bytes -> base64url（无填充，与 webauthn.helpers 相同）"""
+    return base64.urlsafe_b64encode(val).decode("utf-8").replace("=", "")
+
+
+def base64url_to_bytes(val: str) -> bytes:
+    """base64url -> bytes（与 webauthn.helpers 相同）"""
+    return base64.urlsafe_b64decode(f"{val}===")
+
+
+@lru_cache(maxsize=None)
+def _credential_parser(model):
+    """选择凭据解析方法（兼容不同版本的 webauthn / Pydantic），每个类型只判断一次"""
+    if hasattr(model, "model_validate"):  # Pydantic v2
+        return model.model_validate
+    if hasattr(model, "parse_obj"):  # Pydantic v1
+        return model.parse_obj
+    return lambda data: data  # 都不支持时直接使用字典
 
-from webauthn import (
-    generate_registration_options,
-    verify_registration_response,
-    generate_authentication_options,
-    verify_authentication_response,
-    options_to_json,
-)
-from webauthn.helpers import bytes_to_base64url, base64url_to_bytes
-from webauthn.helpers.structs import (
-    AuthenticatorSelectionCriteria,
-    UserVerificationRequirement,
-    ResidentKeyRequirement,
-    PublicKeyCredentialDescriptor,
-    RegistrationCredential,
-    AuthenticationCredential,
-    AuthenticatorAttachment,
-    AttestationConveyancePreference,
-    AuthenticatorTransport,
-)
 
 # ==================== 配置 ====================
 
@@ -41,88 +84,533 @@ RP_ID = os.getenv("PASSKEY_RP_ID", "localhost")  # 域名，如 "example.com"
 RP_NAME = os.getenv("PASSKEY_RP_NAME", "血糖PK")
 ORIGIN = os.getenv("PASSKEY_ORIGIN", "http://localhost:5010")  # 完整 URL
 
-# 用户数据存储文件
-USERS_FILE = ".passkey_users.json"
+# 用户数据存储目录（每个用户一个 JSON 文件）
+# 保存只重写该用户自己的小文件，配合内存中的凭据索引查找，
+# 用户规模（家庭 / 朋友间）下不需要引入数据库
+USERS_DIR = ".passkey_users"
+
+# 旧版单文件存储（启动时自动迁移到 USERS_DIR）
+LEGACY_USERS_FILE = ".passkey_users.json"
+
+# 注册 / 登录挑战存储（不配置则存在进程内存中）
+REDIS_URL = os.getenv("REDIS_URL", "")
 
 
 # ==================== 密码哈希 ====================
 
+# argon2id：带盐、可调成本的慢哈希（单次验证约几十毫秒）
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+
+
+def _is_legacy_hash(password_hash: str) -> bool:
+    """旧版无盐 SHA-256 哈希（64 位十六进制）"""
+    return len(password_hash) == 64 and not password_hash.startswith("$")
+
+
 def hash_password(password: str) -> str:
-    """使用 SHA-256 哈希密码（生产环境建议用 bcrypt）"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """使用 argon2id 哈希密码"""
+    return _password_hasher.hash(password)
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    """验证密码"""
-    return hash_password(password) == password_hash
+    """验证密码（兼容旧版 SHA-256 哈希，比较时间恒定）"""
+    if _is_legacy_hash(password_hash):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, password_hash)
+    
+    try:
+        return _password_hasher.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """哈希是否需要升级（旧版 SHA-256，或 argon2 参数已调整）"""
+    if _is_legacy_hash(password_hash):
+        return True
+    try:
+        return _password_hasher.check_needs_rehash(password_hash)
+    except InvalidHashError:
+        return False
 
 
 # ==================== 存储 ====================
 
+def _loads(data: bytes):
+    """解析 JSON（优先使用 orjson）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj, indent: bool = True) -> bytes:
+    """序列化为 JSON 字节（优先使用 orjson），indent=False 时输出紧凑格式"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@lru_cache(maxsize=4096)
+def _credential_bytes(value: str) -> bytes:
+    """
+    解码存储的 base64url 字段（credential_id / public_key / user_id）
+    
+    这些字段写入后不会改变，按字符串缓存解码结果，登录时不再重复解码；
+    解码结果只放在内存里，不写回用户文件（bytes 也无法 JSON 序列化）
+    """
+    return base64url_to_bytes(value)
+
+
+# 用户数据缓存：每个用户文件 (mtime_ns, size) 未变化时直接复用解析结果
+# 多进程部署下其他 worker 写入会改变文件签名，从而触发重新读取
+# files: 文件名 -> (签名, 用户)
+# cred_index: credential_id -> username，用于无用户名登录时 O(1) 查找
+# dir_mtime: 上次完整扫描时目录的 mtime_ns（用户文件都通过 rename 写入，任何增删改都会改变它）
+_users_cache = {"files": {}, "data": {}, "cred_index": {}, "dir_mtime": None}
+
+# 目录 mtime 距今不足该时间（纳秒）时不信任它，避免同一时间戳内的写入被漏掉
+_DIR_MTIME_SETTLE_NS = 1_000_000_000
+_users_lock = threading.Lock()
+
+# 用户名中可以直接用作文件名的格式（其余用户名做百分号编码并加哈希后缀）
+_SAFE_FILENAME = re.compile(r"[\w\-][\w.\-]*")
+
+
+def _user_file_name(username: str) -> str:
+    """
+    用户名 -> 用户文件名（防止路径穿越，不同用户名不会冲突）
+    
+    macOS / Windows 默认文件系统不区分大小写，Amy 和 amy 会落到同一个文件：
+    只有全小写的安全用户名直接用作文件名，其余的用小写编码 + "~" + 原用户名的哈希，
+    安全用户名里不会出现 "~"，两类文件名也不会互相冲突
+    """
+    if _SAFE_FILENAME.fullmatch(username) and username == username.lower():
+        return f"{username}.json"
+    digest = hashlib.sha256(username.encode()).hexdigest()[:16]
+    return f"{quote(username.lower(), safe='')}~{digest}.json"
+
+
+def _build_credential_index(users: dict) -> dict:
+    """构建 credential_id -> username 索引"""
+    return {
+        cred["credential_id"]: username
+        for username, user in users.items()
+        for cred in user.get("credentials", [])
+    }
+
+
+def _set_cache_files(files: dict):
+    """更新文件缓存，并重建用户字典和凭据索引（调用方需持有 _users_lock）"""
+    users = {user["username"]: user for _, user in files.values()}
+    _users_cache["files"] = files
+    _users_cache["data"] = users
+    _users_cache["cred_index"] = _build_credential_index(users)
+
+
+def _update_cache_file(name: str, entry: Optional[tuple]):
+    """
+    更新单个用户文件的缓存，entry 为 (签名, 用户)，None 表示已删除（调用方需持有 _users_lock）
+    
+    凭据索引只增删该用户的凭据，不再为一次保存重建全部用户的索引
+    """
+    files = _users_cache["files"]
+    users = dict(_users_cache["data"])  # 其他线程可能正在遍历，复制后替换
+    cred_index = _users_cache["cred_index"]
+    
+    old = files.pop(name, None)
+    if old is not None:
+        old_user = old[1]
+        users.pop(old_user["username"], None)
+        for cred in old_user.get("credentials", []):
+            if cred_index.get(cred["credential_id"]) == old_user["username"]:
+                del cred_index[cred["credential_id"]]
+    
+    if entry is not None:
+        user = entry[1]
+        files[name] = entry
+        users[user["username"]] = user
+        for cred in user.get("credentials", []):
+            cred_index[cred["credential_id"]] = user["username"]
+    
+    _users_cache["data"] = users
+
+
+def _read_user_file(path: str) -> Optional[tuple]:
+    """
+    读取单个用户文件，返回 (签名, 用户)，失败返回 None
+    
+    签名从读取用的同一个文件描述符取得：stat 之后文件被其他 worker 替换时，
+    缓存的签名和内容仍然对应同一个文件
+    """
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            return (st.st_mtime_ns, st.st_size), _loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ 加载用户数据失败 ({path}): {e}")
+        return None
+
+
+def _load_users_with_index() -> tuple:
+    """加载用户数据和凭据索引（带缓存），返回 (users, cred_index)"""
+    try:
+        dir_mtime = os.stat(USERS_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return {}, {}
+    
+    # 目录没有变化：不用逐个 stat 用户文件
+    if dir_mtime == _users_cache["dir_mtime"]:
+        return _users_cache["data"], _users_cache["cred_index"]
+    
+    try:
+        entries = [e for e in os.scandir(USERS_DIR) if e.name.endswith(".json")]
+    except FileNotFoundError:
+        return {}, {}
+    
+    with _users_lock:
+        files = _users_cache["files"]
+        new_files = {}
+        changed = False
+        
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            signature = (st.st_mtime_ns, st.st_size)
+            
+            cached = files.get(entry.name)
+            if cached and cached[0] == signature:
+                new_files[entry.name] = cached
+                continue
+            
+            changed = True
+            loaded = _read_user_file(entry.path)
+            if loaded is not None:
+                new_files[entry.name] = loaded
+        
+        if changed or new_files.keys() != files.keys():
+            _set_cache_files(new_files)
+        if time.time_ns() - dir_mtime > _DIR_MTIME_SETTLE_NS:
+            _users_cache["dir_mtime"] = dir_mtime
+        return _users_cache["data"], _users_cache["cred_index"]
+
+
+def _load_user(username: str) -> Optional[dict]:
+    """
+    加载单个用户（带缓存），只 stat / 解析该用户自己的文件
+    
+    进程刚启动时不需要先解析全部用户文件，登录只读一个小文件
+    """
+    name = _user_file_name(username)
+    path = os.path.join(USERS_DIR, name)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    signature = (st.st_mtime_ns, st.st_size)
+    
+    cached = _users_cache["files"].get(name)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    loaded = _read_user_file(path)
+    if loaded is None:
+        return None
+    
+    with _users_lock:
+        _update_cache_file(name, loaded)
+    return loaded[1]
+
+
 def _load_users() -> dict:
-    """加载用户数据"""
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"⚠️ 加载用户数据失败: {e}")
-            return {}
-    return {}
+    """
+    加载用户数据（带缓存）
+    
+    返回的是共享缓存，只读；需要修改时通过 get_user 获取副本再 save_user
+    """
+    return _load_users_with_index()[0]
+
+
+def _fsync_dir(path: str):
+    """落盘目录本身，保证 rename / 删除在断电后也不会丢失（仅 POSIX）"""
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
-def _save_users(users: dict):
-    """保存用户数据"""
+def _write_user_file(user: dict) -> bool:
+    """保存单个用户文件（同时更新缓存和凭据索引）"""
+    name = _user_file_name(user["username"])
+    path = os.path.join(USERS_DIR, name)
     try:
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(users, f, indent=2, ensure_ascii=False)
+        os.makedirs(USERS_DIR, exist_ok=True)
+        
+        # 先写临时文件并落盘，再原子替换，崩溃时不会留下写了一半的用户文件
+        # 临时文件带进程号，多个 worker 同时保存同一用户时互不覆盖
+        # 签名在替换前从临时文件取得（rename 不改变 mtime / 大小），
+        # 替换后其他 worker 再写入时签名不同，下次读取会重新加载
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(_dumps(user))
+            f.flush()
+            os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.replace(tmp_file, path)
+        _fsync_dir(USERS_DIR)
     except Exception as e:
         print(f"❌ 保存用户数据失败: {e}")
+        return False
+    
+    # 缓存副本：调用方之后修改自己的 dict 不会影响缓存
+    with _users_lock:
+        _update_cache_file(name, ((st.st_mtime_ns, st.st_size), copy.deepcopy(user)))
+    return True
+
+
+def _remove_user_file(username: str) -> bool:
+    """删除单个用户文件（同时更新缓存）"""
+    name = _user_file_name(username)
+    try:
+        os.remove(os.path.join(USERS_DIR, name))
+    except FileNotFoundError:
+        return False
+    _fsync_dir(USERS_DIR)
+    
+    with _users_lock:
+        _update_cache_file(name, None)
+    return True
+
+
+def _migrate_legacy_users():
+    """把旧版 .passkey_users.json 拆分为每个用户一个文件（只执行一次）"""
+    try:
+        with open(LEGACY_USERS_FILE, "rb") as f:
+            users = _loads(f.read())
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        print(f"⚠️ 读取旧版用户数据失败，跳过迁移: {e}")
+        return
+    
+    for user in users.values():
+        if not os.path.exists(os.path.join(USERS_DIR, _user_file_name(user["username"]))):
+            _write_user_file(user)
+    
+    # 旧文件保留为备份，避免重复迁移
+    try:
+        os.replace(LEGACY_USERS_FILE, LEGACY_USERS_FILE + ".migrated")
+        print(f"✅ 已迁移 {len(users)} 个用户到 {USERS_DIR}/")
+    except FileNotFoundError:
+        pass  # 其他进程已完成迁移
+
+
+def _migrate_user_file_names():
+    """把按旧规则命名的用户文件（如 Amy.json）改名为当前规则的文件名（只在启动时执行）"""
+    try:
+        entries = [e for e in os.scandir(USERS_DIR) if e.name.endswith(".json")]
+    except FileNotFoundError:
+        return
+    
+    for entry in entries:
+        loaded = _read_user_file(entry.path)
+        if loaded is None or "username" not in loaded[1]:
+            continue
+        user = loaded[1]
+        name = _user_file_name(user["username"])
+        path = os.path.join(USERS_DIR, name)
+        if entry.name == name or os.path.exists(path):
+            continue
+        try:
+            os.replace(entry.path, path)
+        except FileNotFoundError:
+            continue  # 其他进程已完成改名
+        print(f"✅ 用户文件已改名: {entry.name} -> {name}")
+    _fsync_dir(USERS_DIR)
 
 
 def get_user(username: str) -> Optional[dict]:
-    """获取用户"""
-    users = _load_users()
-    return users.get(username)
+    """获取用户（返回副本，可直接修改后 save_user）"""
+    user = _load_user(username)
+    return copy.deepcopy(user) if user is not None else None
 
 
 def get_user_by_credential_id(credential_id: str) -> Optional[dict]:
     """通过凭据 ID 查找用户（用于无用户名登录）"""
-    users = _load_users()
-    for username, user in users.items():
-        for cred in user.get("credentials", []):
-            if cred["credential_id"] == credential_id:
-                return user
-    return None
+    users, cred_index = _load_users_with_index()
+    username = cred_index.get(credential_id)
+    if username is None or username not in users:
+        return None
+    return copy.deepcopy(users[username])
+
+
+# 用户文件写入锁：进程内线程锁 + 跨进程文件锁，
+# "读取 - 合并 - 写回"期间其他线程 / worker 不会写入用户文件
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def _user_write_lock():
+    """持有用户文件写入锁（save_user / 删除用户 / sign_count 写回共用）"""
+    with _write_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(USERS_DIR, exist_ok=True)
+        fd = os.open(os.path.join(USERS_DIR, ".write.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # 关闭文件即释放 flock
+
+
+def _merge_sign_counts(credentials: list, counts: dict) -> list:
+    """把 credential_id -> sign_count 按较大值合并进凭据列表（sign_count 只增不减）"""
+    return [
+        {**c, "sign_count": counts[c["credential_id"]]}
+        if counts.get(c["credential_id"], -1) > c.get("sign_count", 0) else c
+        for c in credentials
+    ]
 
 
 def save_user(user: dict):
-    """保存用户"""
-    users = _load_users()
-    users[user["username"]] = user
-    _save_users(users)
+    """
+    保存用户（只重写该用户自己的文件）
+    
+    调用方读取之后，其他 worker / 延迟写入可能已经更新过 sign_count，写回时按较大值保留
+    """
+    with _user_write_lock():
+        current = _load_user(user["username"])
+        if current is not None:
+            counts = {c["credential_id"]: c.get("sign_count", 0) for c in current.get("credentials", [])}
+            user = {**user, "credentials": _merge_sign_counts(user.get("credentials", []), counts)}
+        _write_user_file(user)
+
+
+# sign_count 延迟写入：登录后先记在内存，短时间内合并写盘
+# 丢失一次计数更新只会让重放检测稍宽松，不影响登录
+SIGN_COUNT_FLUSH_DELAY = 0.5  # 秒
+_pending_sign_counts = {}  # (username, credential_id) -> sign_count
+_pending_lock = threading.Lock()
+_flush_timer = None
+
+
+def _flush_sign_counts():
+    """
+    把待写入的 sign_count 写回用户文件（每个用户只写一次）
+    
+    持有写入锁后重新读取用户文件再按较大值合并，不会覆盖期间 save_user 增删的凭据；
+    写入完成后才从待写入表中移除，写入期间验证仍能用到这些计数
+    """
+    global _flush_timer
+    with _pending_lock:
+        pending = dict(_pending_sign_counts)
+        _flush_timer = None
+    if not pending:
+        return  # 退出时（atexit）通常没有待写入的计数，不必获取写入锁
+    
+    by_user = {}
+    for (username, credential_id), count in pending.items():
+        by_user.setdefault(username, {})[credential_id] = count
+    
+    with _user_write_lock():
+        for username, counts in by_user.items():
+            user = _load_user(username)
+            if user is None:
+                continue
+            _write_user_file({**user, "credentials": _merge_sign_counts(user.get("credentials", []), counts)})
+    
+    with _pending_lock:
+        for key, count in pending.items():
+            if _pending_sign_counts.get(key) == count:
+                del _pending_sign_counts[key]
+
+
+def _current_sign_count(username: str, credential_id: str, stored: int) -> int:
+    """验证用的当前 sign_count：文件中的值和尚未写回的值取较大者"""
+    with _pending_lock:
+        pending = _pending_sign_counts.get((username, credential_id))
+    return stored if pending is None else max(stored, pending)
+
+
+def update_sign_count(username: str, credential_id: str, new_count: int) -> bool:
+    """
+    更新单个凭据的 sign_count（每次 Passkey 登录后调用）
+    
+    计数没有变化时不写文件（很多平台认证器的 sign_count 始终为 0），
+    有变化时延迟 SIGN_COUNT_FLUSH_DELAY 秒批量写入
+    """
+    global _flush_timer
+    user = _load_user(username)
+    if user is None:
+        return False
+    
+    cred = next(
+        (c for c in user.get("credentials", []) if c["credential_id"] == credential_id),
+        None
+    )
+    if cred is None:
+        return False
+    
+    with _pending_lock:
+        pending = _pending_sign_counts.get((username, credential_id), cred.get("sign_count", 0))
+        if new_count <= pending:
+            return True  # 计数只增不减，不会用较小的值覆盖尚未写回的计数
+        _pending_sign_counts[(username, credential_id)] = new_count
+        
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(SIGN_COUNT_FLUSH_DELAY, _flush_sign_counts)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+    return True
+
+
+# 进程正常退出（包括 gunicorn 收到 SIGTERM 后的优雅退出）时写完剩余计数
+atexit.register(_flush_sign_counts)
+
+
+# get_all_users 结果缓存：(生成时的用户字典, 摘要列表)
+# 用户字典每次变化都会整体替换成新对象，对象不同才重新生成摘要
+_users_summary = {"entry": (None, [])}
 
 
 def get_all_users() -> list:
     """获取所有用户（不含敏感信息）"""
     users = _load_users()
-    return [
-        {
-            "username": u["username"],
-            "display_name": u["display_name"],
-            "credential_count": len(u.get("credentials", [])),
-            "has_password": "password_hash" in u,
-            "created_at": u.get("created_at", ""),
-            "avatar": u.get("avatar", ""),
-            "color": u.get("color", "#4CAF50"),
-        }
-        for u in users.values()
-    ]
+    source, summary = _users_summary["entry"]
+    if source is not users:
+        summary = [
+            {
+                "username": u["username"],
+                "display_name": u["display_name"],
+                "credential_count": len(u.get("credentials", [])),
+                "has_password": "password_hash" in u,
+                "created_at": u.get("created_at", ""),
+                "avatar": u.get("avatar", ""),
+                "color": u.get("color", "#4CAF50"),
+            }
+            for u in users.values()
+        ]
+        _users_summary["entry"] = (users, summary)
+    return list(summary)
 
 
 def has_any_user() -> bool:
-    """检查是否有任何用户"""
-    return len(_load_users()) > 0
+    """检查是否有任何用户（只看有没有用户文件，找到一个就返回，不解析内容）"""
+    try:
+        with os.scandir(USERS_DIR) as entries:
+            return any(entry.name.endswith(".json") for entry in entries)
+    except FileNotFoundError:
+        return False
 
 
 def update_user_avatar(username: str, avatar_path: str) -> bool:
@@ -206,6 +694,11 @@ def login_with_password(username: str, password: str) -> dict:
     if not verify_password(password, user["password_hash"]):
         raise ValueError("用户名或密码错误")
     
+    # 登录成功时顺便把旧哈希升级为 argon2id
+    if password_needs_rehash(user["password_hash"]):
+        user["password_hash"] = hash_password(password)
+        save_user(user)
+    
     return {
         "username": user["username"],
         "display_name": user["display_name"],
@@ -232,8 +725,65 @@ def change_password(username: str, old_password: str, new_password: str) -> bool
 
 # ==================== Passkey 注册流程 ====================
 
-# 临时存储注册挑战（生产环境应用 Redis）
-_registration_challenges = {}
+# 挑战有效期（秒），与前端 WebAuthn timeout 对应并留有余量
+CHALLENGE_TTL = 300
+
+# 内存存储时每类挑战最多保留的条目数（防止恶意刷接口占满内存）
+CHALLENGE_MAX_ENTRIES = 10000
+
+
+class ChallengeStore:
+    """
+    一次性挑战存储（带过期时间）
+    
+    配置了 REDIS_URL 时存到 Redis：自动过期，多个 worker 共享，
+    在 A 进程开始、B 进程完成的流程也能验证通过；
+    否则存在进程内存里，按写入顺序淘汰过期 / 超量的条目
+    """
+    
+    def __init__(self, prefix: str, ttl: int = CHALLENGE_TTL):
+        self.prefix = prefix
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(REDIS_URL) if redis is not None and REDIS_URL else None
+        # key -> (创建时间 monotonic, 挑战数据)，dict 保持写入顺序，最旧的在最前
+        self._local = {}
+        self._lock = threading.Lock()
+    
+    def set(self, key: str, payload: dict):
+        """保存挑战"""
+        if self._redis is not None:
+            self._redis.set(self.prefix + key, _dumps(payload, indent=False), ex=self.ttl)
+            return
+        
+        now = time.monotonic()
+        with self._lock:
+            self._local.pop(key, None)  # 重新插入到末尾，保持时间顺序
+            # 从最旧的开始清理，遇到未过期的就停止
+            while self._local:
+                oldest_key, (created, _) = next(iter(self._local.items()))
+                if now - created <= self.ttl and len(self._local) < CHALLENGE_MAX_ENTRIES:
+                    break
+                del self._local[oldest_key]
+            self._local[key] = (now, payload)
+    
+    def pop(self, key: str) -> Optional[dict]:
+        """取出挑战（一次性），不存在或已过期返回 None"""
+        if self._redis is not None:
+            pipe = self._redis.pipeline()
+            pipe.get(self.prefix + key)
+            pipe.delete(self.prefix + key)
+            raw, _ = pipe.execute()
+            return _loads(raw) if raw else None
+        
+        with self._lock:
+            entry = self._local.pop(key, None)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+
+# 临时存储注册挑战（按用户名）
+_registration_challenges = ChallengeStore("passkey:registration:")
 
 
 def start_registration(username: str, display_name: str = None) -> dict:
@@ -241,6 +791,16 @@ def start_registration(username: str, display_name: str = None) -> dict:
     开始 Passkey 注册流程
     可以为新用户注册，也可以为现有用户添加新设备
     """
+    from webauthn import generate_registration_options, options_to_json
+    from webauthn.helpers.structs import (
+        AuthenticatorSelectionCriteria,
+        UserVerificationRequirement,
+        ResidentKeyRequirement,
+        PublicKeyCredentialDescriptor,
+        AuthenticatorAttachment,
+        AttestationConveyancePreference,
+    )
+    
     if not display_name:
         display_name = username
     
@@ -248,9 +808,9 @@ def start_registration(username: str, display_name: str = None) -> dict:
     existing_user = get_user(username)
     if existing_user:
         # 现有用户，添加新设备
-        user_id = base64url_to_bytes(existing_user["user_id"])
+        user_id = _credential_bytes(existing_user["user_id"])
         exclude_credentials = [
-            PublicKeyCredentialDescriptor(id=base64url_to_bytes(c["credential_id"]))
+            PublicKeyCredentialDescriptor(id=_credential_bytes(c["credential_id"]))
             for c in existing_user.get("credentials", [])
         ]
     else:
@@ -277,17 +837,17 @@ def start_registration(username: str, display_name: str = None) -> dict:
     )
     
     # 保存挑战用于验证
-    _registration_challenges[username] = {
+    _registration_challenges.set(username, {
         "challenge": bytes_to_base64url(options.challenge),
         "user_id": bytes_to_base64url(user_id),
         "display_name": display_name,
         "is_new_user": existing_user is None,
-    }
+    })
     
     # 转换为字典，兼容不同版本的 options_to_json
     result = options_to_json(options)
     if isinstance(result, str):
-        return json.loads(result)
+        return _loads(result)
     else:
         return result  # 已经是字典
 
@@ -297,24 +857,16 @@ def complete_registration(username: str, credential_json: dict, device_name: str
     完成 Passkey 注册
     验证浏览器返回的凭据
     """
-    if username not in _registration_challenges:
-        raise ValueError("未找到注册会话，请重新开始注册")
+    from webauthn import verify_registration_response
+    from webauthn.helpers.structs import RegistrationCredential
     
     challenge_data = _registration_challenges.pop(username)
+    if challenge_data is None:
+        raise ValueError("未找到注册会话，请重新开始注册")
     
     try:
-        # 将字典转换为 RegistrationCredential 对象
-        # 兼容不同版本的 webauthn
-        try:
-            # 尝试 Pydantic v2 方法
-            credential = RegistrationCredential.model_validate_json(json.dumps(credential_json))
-        except AttributeError:
-            try:
-                # 尝试 Pydantic v1 方法
-                credential = RegistrationCredential.parse_raw(json.dumps(credential_json))
-            except AttributeError:
-                # 如果都不行，尝试直接使用字典
-                credential = credential_json
+        # 将字典转换为 RegistrationCredential 对象（兼容不同版本的 webauthn）
+        credential = _credential_parser(RegistrationCredential)(credential_json)
         
         verification = verify_registration_response(
             credential=credential,
@@ -376,8 +928,8 @@ def complete_registration(username: str, credential_json: dict, device_name: str
 
 # ==================== Passkey 登录流程 ====================
 
-# 临时存储认证挑战
-_authentication_challenges = {}
+# 临时存储认证挑战（按 session_id）
+_authentication_challenges = ChallengeStore("passkey:authentication:")
 
 
 def start_authentication(username: str = None) -> dict:
@@ -385,6 +937,13 @@ def start_authentication(username: str = None) -> dict:
     开始 Passkey 登录流程
     username: 可选，如果提供则只允许该用户登录
     """
+    from webauthn import generate_authentication_options, options_to_json
+    from webauthn.helpers.structs import (
+        UserVerificationRequirement,
+        PublicKeyCredentialDescriptor,
+        AuthenticatorTransport,
+    )
+    
     print(f"🔑 开始 Passkey 登录: username={username}")
     
     challenge = secrets.token_bytes(32)
@@ -402,7 +961,7 @@ def start_authentication(username: str = None) -> dict:
         
         allow_credentials = [
             PublicKeyCredentialDescriptor(
-                id=base64url_to_bytes(c["credential_id"]),
+                id=_credential_bytes(c["credential_id"]),
                 transports=[AuthenticatorTransport.INTERNAL, AuthenticatorTransport.HYBRID]
             )
             for c in user["credentials"]
@@ -430,16 +989,16 @@ def start_authentication(username: str = None) -> dict:
     
     # 保存挑战
     session_id = secrets.token_urlsafe(16)
-    _authentication_challenges[session_id] = {
+    _authentication_challenges.set(session_id, {
         "challenge": bytes_to_base64url(challenge),
         "username": username,  # 可能为 None
-    }
+    })
     
     # 转换为字典，兼容不同版本的 options_to_json
     try:
         result = options_to_json(options)
         if isinstance(result, str):
-            response = json.loads(result)
+            response = _loads(result)
         else:
             response = result  # 已经是字典
         print(f"   ✅ options_to_json 成功")
@@ -461,10 +1020,12 @@ def complete_authentication(credential_json: dict, session_id: str, username: st
     完成 Passkey 登录
     验证浏览器返回的凭据
     """
-    if session_id not in _authentication_challenges:
-        raise ValueError("未找到登录会话，请重新开始登录")
+    from webauthn import verify_authentication_response
+    from webauthn.helpers.structs import AuthenticationCredential
     
     challenge_data = _authentication_challenges.pop(session_id)
+    if challenge_data is None:
+        raise ValueError("未找到登录会话，请重新开始登录")
     
     # 获取 credential ID
     credential_id = credential_json.get("id") or credential_json.get("rawId")
@@ -483,41 +1044,21 @@ def complete_authentication(credential_json: dict, session_id: str, username: st
         if not user:
             raise ValueError("找不到对应的 Passkey，可能已被删除")
     
-    # 找到对应的凭据
-    credential = None
-    for c in user.get("credentials", []):
-        if c["credential_id"] == credential_id:
-            credential = c
-            break
+    # 找到对应的凭据（按 credential_id 建字典后直接查找）
+    credentials_by_id = {c["credential_id"]: c for c in user.get("credentials", [])}
+    credential = credentials_by_id.get(credential_id)
     
     if not credential:
         raise ValueError("凭据不存在或已被删除")
     
     try:
-        # 将字典转换为 AuthenticationCredential 对象
-        # 兼容不同版本的 webauthn
-        auth_credential = None
+        # 将字典转换为 AuthenticationCredential 对象（兼容不同版本的 webauthn）
         try:
-            # 尝试 Pydantic v2 方法
-            auth_credential = AuthenticationCredential.model_validate_json(json.dumps(credential_json))
-            print(f"✅ 使用 Pydantic v2 解析凭据成功")
-        except AttributeError:
-            try:
-                # 尝试 Pydantic v1 方法
-                auth_credential = AuthenticationCredential.parse_raw(json.dumps(credential_json))
-                print(f"✅ 使用 Pydantic v1 解析凭据成功")
-            except AttributeError:
-                # 如果都不行，尝试直接使用字典
-                auth_credential = credential_json
-                print(f"⚠️ 直接使用字典作为凭据")
+            auth_credential = _credential_parser(AuthenticationCredential)(credential_json)
         except Exception as parse_error:
-            print(f"❌ Pydantic v2 解析失败: {parse_error}")
-            try:
-                auth_credential = AuthenticationCredential.parse_raw(json.dumps(credential_json))
-                print(f"✅ 回退到 Pydantic v1 解析成功")
-            except Exception as parse_error2:
-                print(f"❌ Pydantic v1 也失败: {parse_error2}")
-                auth_credential = credential_json
+            # 解析失败时直接使用字典，交给 verify_authentication_response 处理
+            print(f"⚠️ 凭据解析失败，直接使用字典: {parse_error}")
+            auth_credential = credential_json
         
         print(f"🔐 验证参数:")
         print(f"   RP_ID: {RP_ID}")
@@ -529,8 +1070,10 @@ def complete_authentication(credential_json: dict, session_id: str, username: st
             expected_challenge=base64url_to_bytes(challenge_data["challenge"]),
             expected_rp_id=RP_ID,
             expected_origin=ORIGIN,
-            credential_public_key=base64url_to_bytes(credential["public_key"]),
-            credential_current_sign_count=credential["sign_count"],
+            credential_public_key=_credential_bytes(credential["public_key"]),
+            credential_current_sign_count=_current_sign_count(
+                user["username"], credential_id, credential["sign_count"]
+            ),
         )
     except Exception as e:
         print(f"❌ 验证异常详情: {type(e).__name__}: {e}")
@@ -544,13 +1087,11 @@ def complete_authentication(credential_json: dict, session_id: str, username: st
                          getattr(verification, 'newSignCount', None) or \
                          credential["sign_count"]
         
-        credential["sign_count"] = new_sign_count
+        update_sign_count(user["username"], credential_id, new_sign_count)
     except Exception:
         # 如果无法更新 sign_count，至少不要失败
         pass
     
-    save_user(user)
-    
     return {
         "username": user["username"],
         "display_name": user["display_name"],
@@ -565,26 +1106,20 @@ def delete_credential(username: str, credential_id: str) -> bool:
     if not user:
         return False
     
-    original_count = len(user.get("credentials", []))
-    user["credentials"] = [
-        c for c in user.get("credentials", [])
-        if c["credential_id"] != credential_id
-    ]
-    
-    if len(user["credentials"]) < original_count:
-        save_user(user)
-        return True
+    # 凭据 ID 唯一，找到后原地删除（凭据索引由 save_user 增量更新）
+    credentials = user.get("credentials", [])
+    for i, c in enumerate(credentials):
+        if c["credential_id"] == credential_id:
+            del credentials[i]
+            save_user(user)
+            return True
     return False
 
 
 def delete_user(username: str) -> bool:
     """删除用户（慎用！）"""
-    users = _load_users()
-    if username in users:
-        del users[username]
-        _save_users(users)
-        return True
-    return False
+    with _user_write_lock():
+        return _remove_user_file(username)
 
 
 def add_password_to_existing_user(username: str, password: str) -> bool:
@@ -701,5 +1236,10 @@ def cli():
         print(f"未知命令: {command}")
 
 
+# 启动时迁移旧格式
+_migrate_legacy_users()
+_migrate_user_file_names()
+
+
 if __name__ == "__main__":
     cli()
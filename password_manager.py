@@ -18,11 +18,32 @@
 """
 
 import os
-import sys
-import getpass
-import json
-import argparse
+import re
+import shutil
+import time
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
+
+# keyring / cryptography 都是可选依赖，模块加载时导入一次
+try:
+    import keyring
+    from keyring.backends import fail as keyring_fail
+except ImportError:
+    keyring = None
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:
+    Fernet = None
+
+# 可选：rfernet（Rust 实现）加解密短密码更快，token 格式与 Fernet 规范一致
+try:
+    import rfernet
+except ImportError:
+    rfernet = None
 
 # ==================== 配置 ====================
 
@@ -30,6 +51,9 @@ SERVICE_NAME = "glucose-pk"
 SECRET_KEY_FILE = ".secret_key"
 ENV_FILE = ".env"
 
+# .env 中加密密码的键名: USER_<ID>_PASSWORD_ENCRYPTED
+_USER_PASSWORD_KEY = re.compile(r'USER_(\d+)_PASSWORD_ENCRYPTED')
+
 
 # ==================== 后端检测 ====================
 
@@ -46,17 +70,30 @@ def detect_best_backend() -> str:
     return "encrypted"
 
 
-def _is_keyring_available() -> bool:
-    """检测 Keyring 是否可用"""
+def _is_keyring_available(flush_cache: bool = False) -> bool:
+    """
+    检测 Keyring 是否可用
+    
+    检测需要往系统钥匙串做一次测试写入，结果在进程内缓存；
+    flush_cache=True 时重新检测（例如用户刚解锁了钥匙串）
+    """
+    if flush_cache:
+        _probe_keyring.cache_clear()
+    return _probe_keyring()
+
+
+@lru_cache(maxsize=1)
+def _probe_keyring() -> bool:
+    """实际检测 Keyring（测试写入 + 删除）"""
+    if keyring is None:
+        return False
+    
     try:
-        import keyring
-        from keyring.backends import fail
-        
         # 获取当前后端
         backend = keyring.get_keyring()
         
         # 如果是 fail 后端，说明没有可用的 keyring
-        if isinstance(backend, fail.Keyring):
+        if isinstance(backend, keyring_fail.Keyring):
             return False
         
         # 尝试一次测试写入
@@ -68,8 +105,6 @@ def _is_keyring_available() -> bool:
         except Exception:
             return False
             
-    except ImportError:
-        return False
     except Exception:
         return False
 
@@ -82,11 +117,11 @@ def get_backend_info() -> dict:
         "keyring_backend": None,
     }
     
-    try:
-        import keyring
-        info["keyring_backend"] = str(keyring.get_keyring())
-    except:
-        pass
+    if keyring is not None:
+        try:
+            info["keyring_backend"] = str(keyring.get_keyring())
+        except Exception:
+            pass
     
     return info
 
@@ -105,18 +140,15 @@ class KeyringBackend:
     
     @staticmethod
     def set_password(user_id: str, password: str) -> bool:
-        import keyring
         keyring.set_password(SERVICE_NAME, user_id, password)
         return True
     
     @staticmethod
     def get_password(user_id: str) -> str:
-        import keyring
         return keyring.get_password(SERVICE_NAME, user_id)
     
     @staticmethod
     def delete_password(user_id: str) -> bool:
-        import keyring
         try:
             keyring.delete_password(SERVICE_NAME, user_id)
             return True
@@ -131,25 +163,44 @@ class KeyringBackend:
 
 # ==================== 加密文件后端 ====================
 
+# Fernet 实例缓存：密钥 bytes -> Fernet（见 EncryptedBackend._get_fernet）
+_fernet_cache = {}
+_fernet_lock = threading.Lock()
+
+
+class _RustFernet:
+    """rfernet 适配层：接口与 cryptography 的 Fernet 一致（bytes 进 bytes 出）"""
+    
+    def __init__(self, key: bytes):
+        self._fernet = rfernet.Fernet(key.decode())
+    
+    def encrypt(self, data: bytes) -> bytes:
+        token = self._fernet.encrypt(data)
+        return token.encode() if isinstance(token, str) else token
+    
+    def decrypt(self, token: bytes) -> bytes:
+        return self._fernet.decrypt(token.decode())
+
+
 class EncryptedBackend:
-    """加密文件存储（使用 Fernet）"""
+    """
+    加密文件存储（使用 Fernet）
+    
+    密文保持 Fernet token 格式：config.py 和 cgm_manager.py 都靠 gAAAAA 前缀识别加密值，
+    已有 .env / 设备配置里的密文也必须能继续解密，因此不要换成其他密文格式
+    """
     
     name = "encrypted"
     description = "加密文件存储 (AES-128)"
     
     @staticmethod
     def is_available() -> bool:
-        try:
-            from cryptography.fernet import Fernet
-            return True
-        except ImportError:
-            return False
+        return Fernet is not None
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def _get_key() -> bytes:
-        """获取或创建加密密钥"""
-        from cryptography.fernet import Fernet
-        
+        """获取或创建加密密钥（进程内只读一次；轮换密钥需要重启进程）"""
         # 优先从环境变量读取
         env_key = os.getenv("ENCRYPTION_KEY")
         if env_key:
@@ -161,26 +212,49 @@ class EncryptedBackend:
             return key_path.read_bytes()
         
         # 生成新密钥
+        # 密钥在进程内缓存后不会再读文件，多个 worker 同时首次启动时必须用同一个密钥：
+        # 先写临时文件再 link 到目标（目标已存在时失败），只有一个进程的密钥会生效
         key = Fernet.generate_key()
-        key_path.write_bytes(key)
+        tmp_path = Path(f"{SECRET_KEY_FILE}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(key)
+        try:
+            os.link(tmp_path, key_path)
+        except FileExistsError:
+            return key_path.read_bytes()  # 其他进程先生成了
+        finally:
+            tmp_path.unlink()
+        
         print(f"✅ 已生成加密密钥: {SECRET_KEY_FILE}")
         return key
     
+    @staticmethod
+    def _get_fernet():
+        """
+        获取 Fernet 实例（按密钥缓存，每个密钥只构造一次）
+        
+        清除 _get_key 的缓存（轮换密钥）后会自动使用新密钥对应的实例；
+        安装了 rfernet 时使用 Rust 实现，生成的 token 与已有密文互相兼容
+        """
+        key = EncryptedBackend._get_key()
+        fernet = _fernet_cache.get(key)
+        if fernet is not None:
+            return fernet
+        
+        with _fernet_lock:
+            fernet = _fernet_cache.get(key)
+            if fernet is None:
+                fernet = _fernet_cache[key] = _RustFernet(key) if rfernet is not None else Fernet(key)
+            return fernet
+    
     @staticmethod
     def encrypt(password: str) -> str:
         """加密密码"""
-        from cryptography.fernet import Fernet
-        key = EncryptedBackend._get_key()
-        f = Fernet(key)
-        return f.encrypt(password.encode()).decode()
+        return EncryptedBackend._get_fernet().encrypt(password.encode()).decode()
     
     @staticmethod
     def decrypt(encrypted: str) -> str:
         """解密密码"""
-        from cryptography.fernet import Fernet
-        key = EncryptedBackend._get_key()
-        f = Fernet(key)
-        return f.decrypt(encrypted.encode()).decode()
+        return EncryptedBackend._get_fernet().decrypt(encrypted.encode()).decode()
     
     @staticmethod
     def set_password(user_id: str, password: str) -> bool:
@@ -217,73 +291,102 @@ class EncryptedBackend:
     def list_passwords() -> list:
         """列出 .env 中的加密密码"""
         result = []
-        env_path = Path(ENV_FILE)
-        if env_path.exists():
-            content = env_path.read_text()
-            import re
-            for match in re.finditer(r'USER_(\d+)_PASSWORD_ENCRYPTED=', content):
+        for key in _load_env()[1]:
+            match = _USER_PASSWORD_KEY.fullmatch(key)
+            if match:
                 result.append(f"user{match.group(1)}")
         return result
 
 
 # ==================== .env 文件操作 ====================
 
-def _read_env_value(key: str) -> str:
-    """从 .env 读取值"""
+# .env 解析缓存：(文件签名 (mtime_ns, size), 原始行, key -> value)
+_env_cache = {"entry": (None, [], {})}
+
+
+def _load_env() -> tuple:
+    """读取并解析 .env（文件未变化时直接用缓存），返回 (原始行, key -> value)"""
     env_path = Path(ENV_FILE)
-    if not env_path.exists():
-        return None
+    try:
+        st = env_path.stat()
+    except FileNotFoundError:
+        return [], {}
+    signature = (st.st_mtime_ns, st.st_size)
+    
+    cached_signature, lines, data = _env_cache["entry"]
+    if cached_signature != signature:
+        lines = env_path.read_text().splitlines()
+        data = {}
+        for line in lines:
+            key, sep, value = line.strip().partition("=")
+            if sep and not key.startswith("#"):
+                data.setdefault(key, value)  # 与逐行查找一致：同名取第一个
+        _env_cache["entry"] = (signature, lines, data)
+    return lines, data
+
+
+def _write_env_lines(lines: list):
+    """
+    写回 .env（先写临时文件再原子替换）
     
-    for line in env_path.read_text().splitlines():
-        line = line.strip()
-        if line.startswith(f"{key}="):
-            return line[len(key) + 1:]
-    return None
+    替换会换成新文件，临时文件以 0600 创建并沿用原文件权限，
+    保存过的 chmod 600 不会因为写入变成所有人可读
+    """
+    env_path = Path(ENV_FILE)
+    tmp_path = Path(f"{ENV_FILE}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    if env_path.exists():
+        shutil.copymode(env_path, tmp_path)
+    os.replace(tmp_path, env_path)
+
+
+def _read_env_value(key: str) -> str:
+    """从 .env 读取值"""
+    return _load_env()[1].get(key)
 
 
 def _update_env_file(key: str, value: str):
     """更新 .env 文件中的值"""
-    env_path = Path(ENV_FILE)
-    lines = []
-    found = False
+    old_lines, data = _load_env()
+    prefix = f"{key}="
     
-    if env_path.exists():
-        for line in env_path.read_text().splitlines():
-            if line.strip().startswith(f"{key}="):
-                lines.append(f"{key}={value}")
-                found = True
-            else:
-                lines.append(line)
-    
-    if not found:
-        lines.append(f"{key}={value}")
+    if key in data:
+        lines = [f"{key}={value}" if line.strip().startswith(prefix) else line for line in old_lines]
+    else:
+        lines = old_lines + [f"{key}={value}"]
     
-    env_path.write_text("\n".join(lines) + "\n")
+    _write_env_lines(lines)
 
 
 def _remove_env_key(key: str) -> bool:
     """从 .env 删除键"""
-    env_path = Path(ENV_FILE)
-    if not env_path.exists():
+    old_lines, data = _load_env()
+    if key not in data:
         return False
     
-    lines = []
-    found = False
-    for line in env_path.read_text().splitlines():
-        if line.strip().startswith(f"{key}="):
-            found = True
-        else:
-            lines.append(line)
-    
-    if found:
-        env_path.write_text("\n".join(lines) + "\n")
-    return found
+    prefix = f"{key}="
+    _write_env_lines([line for line in old_lines if not line.strip().startswith(prefix)])
+    return True
 
 
 # ==================== 统一接口 ====================
 
+# get_backend 的结果缓存：backend_name -> 后端类（检测结果在进程内不会变化）
+_backend_cache = {}
+
+
 def get_backend(backend_name: str = None):
-    """获取后端实例"""
+    """获取后端实例（每种选择只检测一次）"""
+    backend = _backend_cache.get(backend_name)
+    if backend is None:
+        backend = _backend_cache[backend_name] = _resolve_backend(backend_name)
+    return backend
+
+
+def _resolve_backend(backend_name: str = None):
+    """检测并选择后端"""
     if backend_name is None:
         backend_name = detect_best_backend()
     
@@ -300,13 +403,48 @@ def set_password(user_id: str, password: str, backend_name: str = None) -> bool:
     """存储密码"""
     backend = get_backend(backend_name)
     success = backend.set_password(user_id, password)
+    _invalidate_password(user_id)
     if success:
         print(f"✅ 密码已保存 [{backend.name}]: {user_id}")
     return success
 
 
+# 密码读取缓存：避免每次读取都访问系统钥匙串（Keychain / Secret Service 的 IPC）
+PASSWORD_CACHE_TTL = 60  # 秒
+PASSWORD_CACHE_MAX = 1024
+_password_cache = {}  # (user_id, backend_name) -> (过期时间 monotonic, 密码)
+_password_cache_lock = threading.Lock()
+
+
+def _invalidate_password(user_id: str):
+    """密码修改 / 删除后清除该用户的缓存"""
+    with _password_cache_lock:
+        for key in [k for k in _password_cache if k[0] == user_id]:
+            del _password_cache[key]
+
+
 def get_password(user_id: str, backend_name: str = None) -> str:
-    """获取密码（会尝试所有后端）"""
+    """获取密码（会尝试所有后端，结果缓存 PASSWORD_CACHE_TTL 秒）"""
+    cache_key = (user_id, backend_name)
+    now = time.monotonic()
+    
+    with _password_cache_lock:
+        cached = _password_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    pwd = _lookup_password(user_id, backend_name)
+    if pwd:
+        with _password_cache_lock:
+            _password_cache.pop(cache_key, None)
+            if len(_password_cache) >= PASSWORD_CACHE_MAX:
+                del _password_cache[next(iter(_password_cache))]  # 淘汰最早写入的
+            _password_cache[cache_key] = (now + PASSWORD_CACHE_TTL, pwd)
+    return pwd
+
+
+def _lookup_password(user_id: str, backend_name: str = None) -> str:
+    """实际从后端读取密码"""
     # 如果指定了后端，只用那个
     if backend_name:
         backend = get_backend(backend_name)
@@ -332,6 +470,7 @@ def delete_password(user_id: str, backend_name: str = None) -> bool:
     """删除密码"""
     backend = get_backend(backend_name)
     success = backend.delete_password(user_id)
+    _invalidate_password(user_id)
     if success:
         print(f"✅ 密码已删除 [{backend.name}]: {user_id}")
     else:
@@ -341,34 +480,54 @@ def delete_password(user_id: str, backend_name: str = None) -> bool:
 
 # ==================== CLI ====================
 
-def print_status():
+@dataclass
+class BackendEnv:
+    """后端环境信息：一次性探测，status 和交互模式共用，不重复访问钥匙串 / 解析 .env"""
+    detected: str
+    keyring_available: bool
+    keyring_backend: Optional[str]
+    encrypted_available: bool
+    encrypted_users: list
+    
+    @classmethod
+    def detect(cls) -> "BackendEnv":
+        info = get_backend_info()
+        return cls(
+            detected=info["detected"],
+            keyring_available=info["keyring_available"],
+            keyring_backend=info["keyring_backend"],
+            encrypted_available=EncryptedBackend.is_available(),
+            encrypted_users=EncryptedBackend.list_passwords(),
+        )
+
+
+def print_status(env: BackendEnv = None):
     """打印状态信息"""
-    info = get_backend_info()
+    env = env or BackendEnv.detect()
     
     print("=" * 55)
     print("🔐 密码管理工具")
     print("=" * 55)
     print()
-    print(f"自动检测后端: {info['detected']}")
+    print(f"自动检测后端: {env.detected}")
     print()
     print("后端状态:")
-    print(f"  • Keyring:   {'✅ 可用' if info['keyring_available'] else '❌ 不可用'}")
-    if info['keyring_backend']:
-        print(f"               {info['keyring_backend']}")
-    print(f"  • Encrypted: {'✅ 可用' if EncryptedBackend.is_available() else '❌ 不可用'}")
+    print(f"  • Keyring:   {'✅ 可用' if env.keyring_available else '❌ 不可用'}")
+    if env.keyring_backend:
+        print(f"               {env.keyring_backend}")
+    print(f"  • Encrypted: {'✅ 可用' if env.encrypted_available else '❌ 不可用'}")
     print()
     
     # 显示已存储的密码
     print("已存储的密码:")
     found = False
     
-    if info['keyring_available']:
+    if env.keyring_available:
         # Keyring 不支持列出，但可以尝试检测 .env 中的用户
         pass
     
-    encrypted_users = EncryptedBackend.list_passwords()
-    if encrypted_users:
-        for user in encrypted_users:
+    if env.encrypted_users:
+        for user in env.encrypted_users:
             print(f"  • {user} [encrypted]")
             found = True
     
@@ -378,7 +537,9 @@ def print_status():
 
 def interactive_mode():
     """交互模式"""
-    print_status()
+    import getpass
+    
+    print_status(BackendEnv.detect())
     
     print()
     print("操作:")
@@ -415,6 +576,10 @@ def interactive_mode():
 
 
 def main():
+    # 命令行专用模块在这里才导入：服务端只导入本模块做加解密，不需要它们
+    import argparse
+    import getpass
+    
     parser = argparse.ArgumentParser(
         description="密码管理工具 - 统一存储 Dexcom 密码",
         formatter_class=argparse.RawDescriptionHelpFormatter,
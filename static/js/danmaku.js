@@ -646,11 +646,21 @@ const DanmakuSystem = {
                     : '/api/comments';
                 
                 const response = await fetch(url);
-                const data = await response.json();
                 
-                if (data.success && data.comments.length > 0) {
+                let newComments;
+                if (this.state.lastCommentId) {
+                    // 增量轮询返回 NDJSON（每行一条评论），没有新评论时为 204
+                    if (response.status === 204) return;
+                    const text = await response.text();
+                    newComments = text.split('\n').filter(line => line).map(line => JSON.parse(line));
+                } else {
+                    const data = await response.json();
+                    newComments = data.success ? data.comments : [];
+                }
+                
+                if (newComments.length > 0) {
                     // 添加新评论
-                    data.comments.forEach(comment => {
+                    newComments.forEach(comment => {
                         // 避免重复
                         if (!this.state.comments.find(c => c.id === comment.id)) {
                             this.state.comments.push(comment);
@@ -664,7 +674,7 @@ const DanmakuSystem = {
                     }
                     
                     // 更新最后 ID
-                    this.state.lastCommentId = Math.max(...data.comments.map(c => c.id));
+                    this.state.lastCommentId = Math.max(...newComments.map(c => c.id));
                     
                     // 更新列表
                     this.renderCommentList();
@@ -672,7 +682,7 @@ const DanmakuSystem = {
                     // 显示红点（如果面板关闭）
                     if (!this.state.isPanelOpen) {
                         const badge = document.getElementById('comment-badge');
-                        badge.textContent = data.comments.length;
+                        badge.textContent = newComments.length;
                         badge.style.display = 'block';
                     }
                 }
@@ -12,67 +12,419 @@ CGM 数据同步服务（纯净模式）
 
 数据存储结构：
 glucose_data/
-├── {player_id}.json    # 例如 amy_dexcom_001.json
+├── {player_id}.current.json     # 当前值 + 最后更新时间（每次同步整体重写，很小）
+├── {player_id}.history.ndjson   # 历史数据，每行一条读数（只追加，定期压缩）
 └── ...
 """
 
 import os
 import json
+import bisect
+import logging
 import time
 import threading
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import datetime
+from types import MappingProxyType
+from typing import Optional, List, Dict, Mapping, Tuple
 
-from cgm_manager import cgm_manager
+from cgm_manager import cgm_manager, parse_player_id
+
+logger = logging.getLogger(__name__)
+
+# 可选：orjson / msgspec 序列化、解析更快，都未安装时使用标准库 json
+# _DECODE_ERRORS：解析失败时抛出的异常（orjson / json 都是 ValueError）
+_DECODE_ERRORS = ValueError
+
+try:
+    import orjson
+    
+    def _dumps_line(obj) -> bytes:
+        """序列化为一行 NDJSON"""
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    
+    _loads = orjson.loads
+except ImportError:
+    try:
+        import msgspec
+        
+        _encoder = msgspec.json.Encoder()
+        
+        def _dumps_line(obj) -> bytes:
+            """序列化为一行 NDJSON"""
+            return _encoder.encode(obj) + b"\n"
+        
+        _loads = msgspec.json.Decoder().decode
+        _DECODE_ERRORS = (ValueError, msgspec.DecodeError)
+    except ImportError:
+        def _dumps_line(obj) -> bytes:
+            """序列化为一行 NDJSON"""
+            return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        
+        _loads = json.loads
 
 
 # ==================== 配置 ====================
 
-# 同步间隔（秒）
+# 同步间隔（秒）：最长间隔，能预测下一个读数时间时会提前同步
 SYNC_INTERVAL = 180  # 3 分钟
 
+# CGM 出新读数的周期（秒），按最新读数时间预测下一个读数，出来后立即拉取
+READING_INTERVAL = 300  # 5 分钟
+READING_DELAY = 10      # 读数上传到云端的余量
+
+# 预测时间已过但还没拉到新读数时，多久后重试（秒）
+SYNC_RETRY_INTERVAL = 60
+
+# 两次同步之间的最短间隔（秒）
+SYNC_MIN_INTERVAL = 30
+
 # 本地数据目录
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glucose_data")
 
 # 保留多少小时的历史数据
 HISTORY_HOURS = 48
 
+# 启动时并发认证的线程数
+AUTH_WORKERS = 8
+
+# 定时同步时并发拉取的线程数
+SYNC_WORKERS = 8
+
+# 一轮同步最多等待多久（秒），超时的设备记为失败，不阻塞整轮同步
+SYNC_TIMEOUT = 60
+
+# 历史文件超过这么多行时重写压缩（约为保留时长内读数的 2 倍，5 分钟一条）
+HISTORY_COMPACT_LINES = HISTORY_HOURS * 12 * 2
+
 
 # ==================== 全局状态 ====================
 
-# 数据读写锁（每个玩家一个）
+# 数据读写锁（每个玩家一个），首次创建时由 _data_locks_lock 保护
+# 读缓存命中时不加锁（见 load_player_data），只有写文件和缓存失效后的重新解析才需要它；
+# 用普通互斥锁而不是读写锁：缓存失效时并发的读取方排队，第一个解析完后其余直接命中缓存
 _data_locks: Dict[str, threading.Lock] = {}
+_data_locks_lock = threading.Lock()
+
+# 已解析的玩家数据：player_id -> _PlayerEntry
+# 文件签名（mtime/size）变化说明有其他进程写入，需要重新加载
+_PlayerEntry = namedtuple("_PlayerEntry", [
+    "signature",  # 当前值文件和历史文件的 (mtime, size)
+    "data",       # load_player_data 返回的 dict（共享，不要修改）
+    "lines",      # 历史文件行数，超过 HISTORY_COMPACT_LINES 时压缩
+    "by_time",    # 按时间索引的历史 {datetime: 读数}，用于去重
+    "times",      # 历史读数时间（从旧到新，与 history 顺序相反），用于二分查找时间范围
+])
+_player_cache: Dict[str, _PlayerEntry] = {}
 
-# 同步状态
-sync_status = {
-    "last_sync": None,
-    "last_success": None,
-    "errors": [],
-    "is_running": False,
-    "player_count": 0
-}
+# 定时同步使用的线程池（跨周期复用，线程按需创建）
+_sync_pool = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="cgm-sync")
+
+# 同步状态：不可变元组，每次整体替换（读取方不会看到更新到一半的状态）
+SyncStatus = namedtuple("SyncStatus", "last_sync last_success errors is_running player_count")
+sync_status = SyncStatus(last_sync=None, last_success=None, errors=(), is_running=False, player_count=0)
 
 
 def _get_data_lock(player_id: str) -> threading.Lock:
     """获取玩家的数据锁"""
-    if player_id not in _data_locks:
-        _data_locks[player_id] = threading.Lock()
-    return _data_locks[player_id]
+    lock = _data_locks.get(player_id)
+    if lock is not None:
+        return lock
+    
+    # 并发同步时多个线程可能同时首次访问，setdefault 保证只创建一把锁
+    with _data_locks_lock:
+        return _data_locks.setdefault(player_id, threading.Lock())
+
 
+# player_id 中不能出现在文件名里的字符
+_PATH_SAFE = str.maketrans({"/": "_", "\\": "_"})
 
-def _get_player_data_file(player_id: str) -> str:
-    """获取玩家数据文件路径"""
-    os.makedirs(DATA_DIR, exist_ok=True)
+
+def _get_player_data_file(player_id: str, suffix: str = "json") -> str:
+    """获取玩家数据文件路径（suffix: current.json / history.ndjson，默认为旧版整文件）"""
     # 替换可能的非法字符
-    safe_id = player_id.replace("/", "_").replace("\\", "_")
-    return os.path.join(DATA_DIR, f"{safe_id}.json")
+    safe_id = player_id.translate(_PATH_SAFE)
+    return os.path.join(DATA_DIR, f"{safe_id}.{suffix}")
 
 
 # ==================== 数据读写 ====================
 
+def _write_file(filepath: str, payload: bytes, durable: bool = True) -> os.stat_result:
+    """
+    先写临时文件，再重命名（原子操作），返回写入的文件状态
+    
+    durable=False 时跳过 fsync：崩溃后可能回到旧内容，但文件不会损坏；
+    临时文件名带上进程号，多个 worker 同时写同一个玩家时不会互相覆盖临时文件。
+    文件状态在重命名前取得（重命名不改变 inode / mtime），不会把其他进程随后的写入算进来
+    """
+    temp_file = f"{filepath}.{os.getpid()}.tmp"
+    with open(temp_file, "wb") as f:
+        f.write(payload)
+        f.flush()
+        if durable:
+            os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    os.replace(temp_file, filepath)
+    return st
+
+
+def _append_history(player_id: str, items: list) -> Optional[Tuple[int, int, int, int]]:
+    """
+    追加新读数到历史文件末尾（单次 write，不读取、不重写已有数据）
+    
+    Returns:
+        (inode, 写入起始位置, 写入结束位置, 写入后的 mtime)；没有新读数时返回 None
+    """
+    if not items:
+        return None
+    
+    payload = b"".join(_dumps_line(item) for item in items)
+    filepath = _get_player_data_file(player_id, "history.ndjson")
+    fd = os.open(filepath, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        # 上次写入中途崩溃会留下没有换行的半行，先补一个换行，
+        # 否则新的第一条读数会和半行拼在一起，读取时被一起跳过
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b"\n":
+            payload = b"\n" + payload
+        os.write(fd, payload)
+        # O_APPEND 写入后文件位置就是本次写入的末尾（其他进程同时追加也不影响）
+        end = os.lseek(fd, 0, os.SEEK_CUR)
+        st = os.fstat(fd)
+    finally:
+        os.close(fd)
+    return st.st_ino, end - len(payload), end, st.st_mtime_ns
+
+
+def _read_history(player_id: str) -> Tuple[list, int, dict]:
+    """
+    逐行读取历史文件
+    
+    Returns:
+        (按时间去重后的历史数据（最新在前）, 文件行数, 按时间索引的历史)
+    """
+    by_time = {}
+    lines = 0
+    try:
+        with open(_get_player_data_file(player_id, "history.ndjson"), "rb") as f:
+            for line in f:
+                lines += 1
+                try:
+                    item = _loads(line)
+                except _DECODE_ERRORS:
+                    continue  # 跳过写了一半的行
+                by_time[item.get("datetime", "")] = item
+    except FileNotFoundError:
+        pass
+    
+    history = sorted(by_time.values(), key=lambda x: x.get("datetime", ""), reverse=True)
+    return _drop_expired_tail(history, by_time), lines, by_time
+
+
+def _read_history_tail(player_id: str, ino: int, offset: int, end: int) -> Optional[Tuple[list, int]]:
+    """
+    只读取历史文件 [offset, end) 之间追加的部分（其他进程同步后追上进度用）
+    
+    只读到签名记录的 end 为止，之后再追加的内容留给下次读取，缓存的位置和实际读到的一致
+    
+    Returns:
+        (新读数列表, 新增行数)；文件已被重写或末尾是写了一半的行时返回 None，由调用方整体重新加载
+    """
+    with open(_get_player_data_file(player_id, "history.ndjson"), "rb") as f:
+        if os.fstat(f.fileno()).st_ino != ino:
+            return None
+        f.seek(offset)
+        tail = f.read(end - offset)
+    if not tail.endswith(b"\n"):
+        return None
+    
+    items = []
+    lines = tail.splitlines()
+    for line in lines:
+        try:
+            items.append(_loads(line))
+        except _DECODE_ERRORS:
+            continue  # 补齐半行时多出的空行
+    return items, len(lines)
+
+
+def _cutoff_str(seconds: int) -> str:
+    """
+    计算 seconds 秒之前的 ISO 时间字符串（精确到秒，无时区）
+    
+    读数时间都是 isoformat() 生成的，前 19 位是本地时间 YYYY-MM-DDTHH:MM:SS，
+    直接按字符串比较与"解析后去掉时区再比较"结果一致，不必逐条 fromisoformat
+    """
+    return _local_iso(int(time.time()) - seconds)
+
+
+@lru_cache(maxsize=64)
+def _local_iso(epoch: int) -> str:
+    """epoch 秒 -> 本地时间 ISO 字符串（同一秒内的多次请求直接命中缓存）"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(epoch))
+
+
+def _drop_expired_tail(history: list, by_time: Optional[dict] = None) -> list:
+    """
+    从尾部弹出过期数据（history 需已按最新在前排序）
+    
+    只检查尾部已过期的几条和第一条未过期的，不必逐条检查整个列表
+    """
+    cutoff = _cutoff_str(HISTORY_HOURS * 3600)
+    while history and history[-1].get("datetime", "") <= cutoff:
+        expired = history.pop()
+        if by_time is not None:
+            by_time.pop(expired.get("datetime", ""), None)
+    return history
+
+
+def _merge_history(history: list, new_items: list, by_time: dict) -> list:
+    """
+    把新读数合并进历史（不修改传入的 history）
+    
+    常见情况下新读数都比已有数据新，直接拼接即可，不必重新排序整个列表；
+    没有新读数且没有过期数据时直接返回原列表，连复制都省掉
+    """
+    if not new_items and (not history or history[-1].get("datetime", "") > _cutoff_str(HISTORY_HOURS * 3600)):
+        return history
+    
+    new_items.sort(key=lambda x: x.get("datetime", ""), reverse=True)
+    if not history or not new_items or new_items[-1].get("datetime", "") > history[0].get("datetime", ""):
+        merged = new_items + history
+    else:
+        merged = sorted(new_items + history, key=lambda x: x.get("datetime", ""), reverse=True)
+    return _drop_expired_tail(merged, by_time)
+
+
+def _file_signature(player_id: str) -> tuple:
+    """
+    当前值文件的 (mtime, size) 和历史文件的 (inode, mtime, size)，用于判断缓存是否过期
+    
+    历史文件 inode 不变、只是变大，说明其他进程只追加了读数（重写会换成新文件）
+    """
+    try:
+        st = os.stat(_get_player_data_file(player_id, "current.json"))
+        signature = [st.st_mtime_ns, st.st_size]
+    except OSError:
+        signature = [0, -1]
+    try:
+        st = os.stat(_get_player_data_file(player_id, "history.ndjson"))
+        signature += [st.st_ino, st.st_mtime_ns, st.st_size]
+    except OSError:
+        signature += [0, 0, -1]
+    return tuple(signature)
+
+
+def _cache_player_data(player_id: str, data: dict, lines: int, by_time: dict,
+                       signature: Optional[tuple] = None) -> _PlayerEntry:
+    """更新内存缓存（调用方需持有玩家数据锁）；写入文件后调用时重新读取文件签名"""
+    history = data["history"]
+    cached = _player_cache.get(player_id)
+    if cached and cached.data["history"] is history:
+        times = cached.times  # 历史没有变化，时间列也不用重建
+    else:
+        times = [item.get("datetime", "") for item in reversed(history)]
+    
+    entry = _PlayerEntry(signature or _file_signature(player_id), data, lines, by_time, times)
+    _player_cache[player_id] = entry
+    return entry
+
+
+def _load_player_data(player_id: str) -> _PlayerEntry:
+    """
+    加载玩家数据的缓存条目（调用方需持有玩家数据锁）
+    
+    文件未变化时直接返回内存中的数据，条目里的 dict 为共享缓存，调用方不要修改
+    """
+    signature = _file_signature(player_id)
+    cached = _player_cache.get(player_id)
+    if cached and cached.signature == signature:
+        return cached
+    
+    if cached and cached.signature[:2] == signature[:2]:
+        meta = cached.data  # 当前值文件没变，不必重新读取
+    else:
+        meta = _read_current(player_id)
+    
+    # 其他进程只追加了读数：从上次读到的位置接着读，不必重新解析整个历史文件
+    if cached and cached.signature[2] == signature[2] and 0 <= cached.signature[4] < signature[4]:
+        try:
+            tail = _read_history_tail(player_id, signature[2], cached.signature[4], signature[4])
+        except Exception as e:
+            logger.warning("⚠️ 加载 %s 历史数据失败: %s", player_id, e)
+            tail = None
+        if tail is not None:
+            items, tail_lines = tail
+            by_time = cached.by_time
+            new_by_time = {}
+            for item in items:
+                if item.get("datetime", "") not in by_time:
+                    new_by_time[item.get("datetime", "")] = item
+            by_time.update(new_by_time)
+            data = {
+                "player_id": player_id,
+                "last_updated": meta.get("last_updated"),
+                "current": meta.get("current"),
+                "history": _merge_history(cached.data["history"], list(new_by_time.values()), by_time)
+            }
+            return _cache_player_data(player_id, data, cached.lines + tail_lines, by_time, signature)
+    
+    history, lines, by_time = [], 0, {}
+    try:
+        history, lines, by_time = _read_history(player_id)
+    except Exception as e:
+        logger.warning("⚠️ 加载 %s 历史数据失败: %s", player_id, e)
+    
+    data = {
+        "player_id": player_id,
+        "last_updated": meta.get("last_updated"),
+        "current": meta.get("current"),
+        "history": history
+    }
+    return _cache_player_data(player_id, data, lines, by_time, signature)
+
+
+def _read_current(player_id: str) -> dict:
+    """读取当前值文件（不存在或损坏时返回空 dict）"""
+    try:
+        with open(_get_player_data_file(player_id, "current.json"), "rb") as f:
+            return _loads(f.read())
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("⚠️ 加载 %s 数据失败: %s", player_id, e)
+    return {}
+
+
+def _save_current(player_id: str, data: dict, durable: bool = True) -> os.stat_result:
+    """只重写当前值文件（调用方需持有玩家数据锁），返回写入的文件状态"""
+    meta = {
+        "player_id": player_id,
+        "last_updated": data.get("last_updated"),
+        "current": data.get("current")
+    }
+    return _write_file(_get_player_data_file(player_id, "current.json"), _dumps_line(meta), durable)
+
+
+def _save_player_data(player_id: str, data: dict):
+    """整体重写当前值和历史文件（迁移 / 压缩时使用，调用方需持有玩家数据锁）"""
+    history = list(data.get("history", []))
+    hist_st = _write_file(
+        _get_player_data_file(player_id, "history.ndjson"),
+        b"".join(_dumps_line(item) for item in history)
+    )
+    cur_st = _save_current(player_id, data)
+    by_time = {item.get("datetime", ""): item for item in history}
+    signature = (cur_st.st_mtime_ns, cur_st.st_size, hist_st.st_ino, hist_st.st_mtime_ns, hist_st.st_size)
+    _cache_player_data(player_id, {**data, "player_id": player_id, "history": history}, len(history), by_time,
+                       signature)
+
+
 def load_player_data(player_id: str) -> dict:
     """
-    从本地文件加载玩家数据
+    从本地文件加载玩家数据（文件未变化时直接返回内存缓存，调用方不要修改返回值）
     
     Returns:
         dict: {
@@ -82,61 +434,74 @@ def load_player_data(player_id: str) -> dict:
             "history": [ ... ]
         }
     """
-    filepath = _get_player_data_file(player_id)
-    lock = _get_data_lock(player_id)
-    
-    with lock:
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"⚠️ 加载 {player_id} 数据失败: {e}")
+    return _get_player_entry(player_id).data
+
+
+def _get_player_entry(player_id: str) -> _PlayerEntry:
+    """获取玩家数据的缓存条目（需要时从文件重新加载）"""
+    # 快速路径：文件未变化时不加锁直接返回缓存。缓存条目整体替换、数据写入缓存后不再修改，
+    # 所以不加锁读取也不会看到写了一半的数据；同步线程持锁写文件期间签名会变化，走下面的慢路径
+    cached = _player_cache.get(player_id)
+    if cached and cached.signature == _file_signature(player_id):
+        return cached
     
-    # 返回空数据结构
-    return {
-        "player_id": player_id,
-        "last_updated": None,
-        "current": None,
-        "history": []
-    }
+    with _get_data_lock(player_id):
+        return _load_player_data(player_id)
 
 
 def save_player_data(player_id: str, data: dict):
-    """保存玩家数据到本地文件"""
-    filepath = _get_player_data_file(player_id)
-    lock = _get_data_lock(player_id)
+    """保存玩家数据到本地文件（整体重写）"""
+    with _get_data_lock(player_id):
+        try:
+            _save_player_data(player_id, data)
+        except Exception as e:
+            logger.error("❌ 保存 %s 数据失败: %s", player_id, e)
+
+
+def _migrate_legacy():
+    """把旧版 {player_id}.json 整文件拆分为当前值 + NDJSON 历史（只执行一次）"""
+    try:
+        names = os.listdir(DATA_DIR)
+    except FileNotFoundError:
+        return
     
-    with lock:
+    for name in names:
+        if not name.endswith(".json") or name.endswith(".current.json"):
+            continue
+        legacy_file = os.path.join(DATA_DIR, name)
+        player_id = name[:-len(".json")]
         try:
-            # 先写临时文件，再重命名（原子操作）
-            temp_file = filepath + ".tmp"
-            with open(temp_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            os.replace(temp_file, filepath)
+            with open(legacy_file, "rb") as f:
+                data = _loads(f.read())
+            with _get_data_lock(player_id):
+                _save_player_data(player_id, data)
+            os.remove(legacy_file)
         except Exception as e:
-            print(f"❌ 保存 {player_id} 数据失败: {e}")
+            logger.warning("⚠️ 迁移 %s 失败: %s", name, e)
+
+
+def _count_newer(history: list, cutoff: str) -> int:
+    """二分查找 history（最新在前）中时间晚于 cutoff 的条数"""
+    lo, hi = 0, len(history)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if history[mid].get("datetime", "") > cutoff:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
 
 def clean_old_history(history: list, hours: int = HISTORY_HOURS) -> list:
-    """清理过期的历史数据"""
+    """
+    清理过期的历史数据（history 需已按最新在前排序）
+    
+    二分查找第一条过期数据的位置后切片，不必逐条比较
+    """
     if not history:
         return []
     
-    cutoff = datetime.now() - timedelta(hours=hours)
-    
-    cleaned = []
-    for item in history:
-        try:
-            dt_str = item.get("datetime", "")
-            item_time = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
-            # 转为无时区比较
-            if item_time.replace(tzinfo=None) > cutoff:
-                cleaned.append(item)
-        except:
-            continue
-    
-    return cleaned
+    return history[:_count_newer(history, _cutoff_str(hours * 3600))]
 
 
 # ==================== 数据同步 ====================
@@ -154,23 +519,17 @@ def sync_player_data(player_id: str, warmup: bool = False) -> bool:
     """
     try:
         # 解析 player_id
-        parts = player_id.rsplit("_", 2)
-        if len(parts) < 3:
-            print(f"⚠️ 无效的 player_id: {player_id}")
+        username, device_id = parse_player_id(player_id)
+        if not username or not device_id:
+            logger.warning("⚠️ 无效的 player_id: %s", player_id)
             return False
         
-        username = parts[0] if len(parts) == 3 else "_".join(parts[:-2])
-        device_id = f"{parts[-2]}_{parts[-1]}"
-        
         # 获取 Provider
         provider = cgm_manager.get_provider(username, device_id)
         if not provider:
-            print(f"⚠️ 无法获取 {player_id} 的 Provider")
+            logger.warning("⚠️ 无法获取 %s 的 Provider", player_id)
             return False
         
-        # 获取当前血糖
-        current_reading = provider.get_current_reading()
-        
         # 预热模式拉取 24 小时，正常模式拉取 3 小时
         if warmup:
             history_minutes = 1440  # 24 小时
@@ -179,44 +538,61 @@ def sync_player_data(player_id: str, warmup: bool = False) -> bool:
             history_minutes = 180   # 3 小时
             history_count = 36
         
-        history_readings = provider.get_readings(minutes=history_minutes, max_count=history_count)
-        
-        # 加载现有本地数据
-        local_data = load_player_data(player_id)
-        
-        # 更新当前值
-        if current_reading:
-            local_data["current"] = current_reading.to_dict()
-        
-        # 合并历史数据（去重）
-        existing_times = set()
-        for item in local_data.get("history", []):
-            existing_times.add(item.get("datetime"))
-        
-        new_history = list(local_data.get("history", []))
-        
-        for reading in history_readings:
-            dt_str = reading.timestamp.isoformat()
-            if dt_str not in existing_times:
-                new_history.append(reading.to_dict())
-                existing_times.add(dt_str)
+        # 获取当前血糖和历史数据（Dexcom 合并为一次请求）
+        current_reading, history_readings = provider.get_current_and_readings(
+            minutes=history_minutes, max_count=history_count
+        )
         
-        # 按时间排序（最新在前）
-        new_history.sort(key=lambda x: x.get("datetime", ""), reverse=True)
-        
-        # 清理过期数据
-        new_history = clean_old_history(new_history)
-        
-        local_data["history"] = new_history
-        local_data["last_updated"] = datetime.now().isoformat()
-        
-        # 保存到本地
-        save_player_data(player_id, local_data)
+        with _get_data_lock(player_id):
+            # 加载现有本地数据（缓存是共享的，复制一份再修改）
+            entry = _load_player_data(player_id)
+            cached_data, history_lines, by_time = entry.data, entry.lines, entry.by_time
+            local_data = dict(cached_data)
+            
+            # 更新当前值
+            if current_reading:
+                local_data["current"] = current_reading.to_dict()
+            local_data["last_updated"] = datetime.now().isoformat()
+            
+            # 只保留本地没有的新读数（缓存中按时间索引的历史，O(1) 去重）
+            new_by_time = {}
+            for reading in history_readings:
+                item = reading.to_dict()
+                if item["datetime"] not in by_time:
+                    new_by_time.setdefault(item["datetime"], item)
+            new_items = list(new_by_time.values())
+            
+            if history_lines + len(new_items) > HISTORY_COMPACT_LINES:
+                # 文件行数过多：合并、清理过期数据后整体重写
+                local_data["history"] = _merge_history(local_data["history"], new_items, {})
+                _save_player_data(player_id, local_data)
+            else:
+                # 常规情况：只追加新读数，再重写很小的当前值文件。
+                # 没有新数据时（CGM 还没出新读数）只有 last_updated 变了，不必 fsync：
+                # 崩溃丢掉的只是一个时间戳，下次同步就会补上
+                appended = _append_history(player_id, new_items)
+                changed = bool(new_items) or local_data["current"] != cached_data["current"]
+                cur_st = _save_current(player_id, local_data, durable=changed)
+                
+                # 缓存的历史文件位置只前进本进程写入的部分：加载后其他进程追加的内容
+                # 位于本次写入之前时保持原位置，下次读取从那里接着读（本进程写入的读数会被去重）
+                ino, hist_mtime, offset = entry.signature[2:]
+                if appended:
+                    new_ino, start, end, mtime = appended
+                    if (new_ino, start) == (ino, offset) or (offset == -1 and start == 0):
+                        ino, hist_mtime, offset = new_ino, mtime, end
+                        history_lines += len(new_items)
+                signature = (cur_st.st_mtime_ns, cur_st.st_size, ino, hist_mtime, offset)
+                
+                # 写入成功后再更新缓存（索引只在持有玩家数据锁时修改，读取方只用 history 列表）
+                by_time.update(new_by_time)
+                local_data["history"] = _merge_history(local_data["history"], new_items, by_time)
+                _cache_player_data(player_id, local_data, history_lines, by_time, signature)
         
         return True
         
     except Exception as e:
-        print(f"❌ 同步 {player_id} 失败: {e}")
+        logger.error("❌ 同步 %s 失败: %s", player_id, e)
         return False
 
 
@@ -230,24 +606,44 @@ def check_needs_warmup(player_id: str) -> bool:
     if not history:
         return True
     
-    # 检查数据是否覆盖 24 小时
+    # 检查数据是否覆盖 24 小时：history 已按最新在前排序，最后一条就是最老的数据，
+    # 如果最老的数据不到 20 小时，需要预热
+    return history[-1].get("datetime", "") > _cutoff_str(20 * 3600)
+
+
+def _authenticate_player(player_id: str) -> bool:
+    """认证单个玩家的 Provider"""
+    username, device_id = parse_player_id(player_id)
+    provider = cgm_manager.get_provider(username, device_id) if username else None
+    if not provider:
+        return False
     try:
-        oldest = min(history, key=lambda x: x.get("datetime", ""))
-        oldest_time = datetime.fromisoformat(oldest["datetime"].replace("Z", "+00:00"))
-        age = datetime.now() - oldest_time.replace(tzinfo=None)
-        
-        # 如果最老的数据不到 20 小时，需要预热
-        if age < timedelta(hours=20):
-            return True
-    except:
-        return True
+        return provider.authenticate()
+    except Exception as e:
+        logger.warning("⚠️ %s 认证异常: %s", player_id, e)
+        return False
+
+
+def authenticate_all_players():
+    """
+    启动时并发认证所有玩家的 Provider
+    
+    各设备登录互相独立，并发执行后启动耗时约等于最慢的一次登录，
+    后续预热 / 同步不再被逐个串行登录阻塞。
+    """
+    player_ids = [device["player_id"] for device in cgm_manager.get_all_active_devices()]
+    if not player_ids:
+        return
     
-    return False
+    logger.info("🔑 并发认证 %d 个 CGM 设备...", len(player_ids))
+    with ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="cgm-auth") as executor:
+        results = list(executor.map(_authenticate_player, player_ids))
+    logger.info("   ✅ 认证完成: %d/%d 成功", sum(results), len(player_ids))
 
 
 def warmup_all_players():
     """预热所有玩家数据（拉取 24 小时历史）"""
-    print("🔥 检查是否需要预热数据...")
+    logger.info("🔥 检查是否需要预热数据...")
     
     all_devices = cgm_manager.get_all_active_devices()
     
@@ -255,14 +651,14 @@ def warmup_all_players():
         player_id = device["player_id"]
         
         if check_needs_warmup(player_id):
-            print(f"   📥 预热 {player_id} 数据（拉取24小时历史）...")
+            logger.info("   📥 预热 %s 数据（拉取24小时历史）...", player_id)
             if sync_player_data(player_id, warmup=True):
                 local_data = load_player_data(player_id)
-                print(f"   ✅ {player_id} 预热完成，共 {len(local_data.get('history', []))} 条数据")
+                logger.info("   ✅ %s 预热完成，共 %d 条数据", player_id, len(local_data.get("history", [])))
             else:
-                print(f"   ❌ {player_id} 预热失败")
+                logger.error("   ❌ %s 预热失败", player_id)
         else:
-            print(f"   ✓ {player_id} 数据充足，无需预热")
+            logger.info("   ✓ %s 数据充足，无需预热", player_id)
 
 
 def sync_all_players():
@@ -271,75 +667,162 @@ def sync_all_players():
     
     all_devices = cgm_manager.get_all_active_devices()
     
-    sync_status["last_sync"] = datetime.now().isoformat()
-    sync_status["is_running"] = True
-    sync_status["player_count"] = len(all_devices)
+    sync_status = sync_status._replace(
+        last_sync=datetime.now().isoformat(),
+        is_running=True,
+        player_count=len(all_devices)
+    )
     
     success_count = 0
     errors = []
     
-    for device in all_devices:
-        player_id = device["player_id"]
-        
+    # 各设备的拉取都是网络 IO，并发执行后耗时约等于最慢的一个设备
+    player_ids = [device["player_id"] for device in all_devices]
+    futures = [_sync_pool.submit(sync_player_data, player_id, False) for player_id in player_ids]
+    deadline = time.monotonic() + SYNC_TIMEOUT
+    
+    for player_id, future in zip(player_ids, futures):
         try:
-            if sync_player_data(player_id, warmup=False):
+            if future.result(timeout=max(0, deadline - time.monotonic())):
                 success_count += 1
             else:
                 errors.append(f"{player_id}: 同步失败")
+        except FuturesTimeoutError:
+            errors.append(f"{player_id}: 同步超时")
         except Exception as e:
             errors.append(f"{player_id}: {str(e)}")
     
+    last_success = sync_status.last_success
     if success_count == len(all_devices) and len(all_devices) > 0:
-        sync_status["last_success"] = datetime.now().isoformat()
+        last_success = datetime.now().isoformat()
     
-    sync_status["errors"] = errors[-10:]  # 只保留最近 10 条错误
-    sync_status["is_running"] = False
+    sync_status = sync_status._replace(
+        last_success=last_success,
+        errors=tuple(errors[-10:]),  # 只保留最近 10 条错误
+        is_running=False
+    )
     
     if all_devices:
-        print(f"✅ 数据同步完成: {success_count}/{len(all_devices)} 成功 ({datetime.now().strftime('%H:%M:%S')})")
+        logger.info("✅ 数据同步完成: %d/%d 成功 (%s)", success_count, len(all_devices), time.strftime("%H:%M:%S"))
     else:
-        print(f"⚠️ 没有活跃的 CGM 设备 ({datetime.now().strftime('%H:%M:%S')})")
+        logger.warning("⚠️ 没有活跃的 CGM 设备 (%s)", time.strftime("%H:%M:%S"))
 
 
 # ==================== 后台线程 ====================
 
+def _predict_next_sync() -> Optional[float]:
+    """
+    根据各玩家最新读数时间，预测多少秒后会有新读数（无法预测时返回 None）
+    
+    新读数预计在最新读数后 READING_INTERVAL + READING_DELAY 秒出现；已经过了预计时间、
+    但还没超过一个同步周期的，SYNC_RETRY_INTERVAL 秒后重试；
+    更久没有新数据的（传感器断开等）不参与预测，按正常周期同步
+    """
+    now = time.time()
+    delay = None
+    
+    for device in cgm_manager.get_all_active_devices():
+        current = load_player_data(device["player_id"]).get("current")
+        try:
+            expected = datetime.fromisoformat(current["datetime"]).timestamp() + READING_INTERVAL + READING_DELAY
+        except (TypeError, KeyError, ValueError):
+            continue
+        
+        if expected > now:
+            wait = expected - now
+        elif now - expected < SYNC_INTERVAL:
+            wait = SYNC_RETRY_INTERVAL
+        else:
+            continue
+        delay = wait if delay is None else min(delay, wait)
+    
+    return delay
+
+
 def _sync_loop():
     """后台同步循环"""
-    print(f"🔄 CGM 同步服务启动，间隔: {SYNC_INTERVAL}秒")
+    logger.info("🔄 CGM 同步服务启动，间隔: %d秒", SYNC_INTERVAL)
     
-    # 启动时先预热（补足 24 小时数据）
-    warmup_all_players()
+    # 启动时先并发登录所有设备
+    authenticate_all_players()
     
-    # 然后正常同步一次
-    sync_all_players()
+    # 再预热（补足 24 小时数据）
+    warmup_all_players()
     
-    while True:
-        time.sleep(SYNC_INTERVAL)
+    # 然后循环同步：截止时间基于 monotonic 时钟，同步耗时不会累积成漂移；
+    # 最长 SYNC_INTERVAL 一次，能预测下一个读数时在它出现后立即同步；
+    # force_sync_now() 可以提前唤醒，stop_sync_service() 可以随时退出
+    deadline = time.monotonic()
+    while not _stop.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            _wake.wait(remaining)
+        _wake.clear()
+        if _stop.is_set():
+            break
+        
+        tick_start = time.monotonic()
+        deadline = tick_start + SYNC_INTERVAL
         try:
             sync_all_players()
+            
+            predicted = _predict_next_sync()
+            if predicted is not None:
+                now = time.monotonic()
+                deadline = min(deadline, max(now + predicted, tick_start + SYNC_MIN_INTERVAL))
         except Exception as e:
-            print(f"❌ 同步循环异常: {e}")
+            logger.error("❌ 同步循环异常: %s", e)
+    
+    logger.info("🛑 CGM 同步服务已停止")
 
 
 _sync_thread = None
 
+# 提前唤醒后台同步线程（见 force_sync_now）
+_wake = threading.Event()
+
+# 通知后台同步线程退出（见 stop_sync_service）
+_stop = threading.Event()
+
 
 def start_sync_service():
     """启动后台同步服务"""
     global _sync_thread
     
     if _sync_thread is not None and _sync_thread.is_alive():
-        print("⚠️ 同步服务已在运行")
+        logger.warning("⚠️ 同步服务已在运行")
         return
     
+    _stop.clear()
     _sync_thread = threading.Thread(target=_sync_loop, daemon=True)
     _sync_thread.start()
-    print("🚀 后台同步服务已启动")
+    logger.info("🚀 后台同步服务已启动")
+
+
+def stop_sync_service(timeout: Optional[float] = None):
+    """停止后台同步服务（当前这一轮同步完成后退出）"""
+    _stop.set()
+    _wake.set()
+    if _sync_thread is not None:
+        _sync_thread.join(timeout)
+
+
+def force_sync_now():
+    """立即唤醒后台线程同步一次，不必等到下一个同步周期"""
+    _wake.set()
+
+
+def get_sync_status() -> Mapping:
+    """获取同步状态（只读视图）"""
+    return _status_view(sync_status)
 
 
-def get_sync_status() -> dict:
-    """获取同步状态"""
-    return sync_status.copy()
+@lru_cache(maxsize=1)
+def _status_view(status: SyncStatus) -> Mapping:
+    """状态元组 -> 只读字典视图（状态没变时 HTTP 轮询直接复用同一个视图）"""
+    view = status._asdict()
+    view["errors"] = list(view["errors"])
+    return MappingProxyType(view)
 
 
 # ==================== 供 data_fetcher 调用的接口 ====================
@@ -367,34 +850,26 @@ def get_history_from_local(player_id: str, minutes: int = 180, max_count: int =
     Returns:
         list: 历史数据列表
     """
-    data = load_player_data(player_id)
-    history = data.get("history", [])
-    
-    if not history:
-        return []
+    entry = _get_player_entry(player_id)
+    times = entry.times
     
-    # 过滤时间范围
-    cutoff = datetime.now() - timedelta(minutes=minutes)
-    filtered = []
+    # 过滤时间范围：时间列从旧到新排列，二分查找第一条晚于 cutoff 的位置，
+    # 它之后的都在范围内；history 是最新在前，对应的就是开头的 newer 条（按字符串比较，不必解析时间）
+    newer = len(times) - bisect.bisect_right(times, _cutoff_str(minutes * 60))
     
-    for item in history:
-        try:
-            dt_str = item.get("datetime", "")
-            item_time = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
-            if item_time.replace(tzinfo=None) > cutoff:
-                filtered.append(item)
-        except:
-            continue
-    
-    # 按时间排序（最新在前），限制条数
-    filtered.sort(key=lambda x: x.get("datetime", ""), reverse=True)
-    
-    return filtered[:max_count]
+    return entry.data["history"][:min(newer, max_count)]
+
+
+# 启动时创建数据目录（只做一次，读写路径上不再检查），并迁移旧格式
+os.makedirs(DATA_DIR, exist_ok=True)
+_migrate_legacy()
 
 
 # ==================== 测试入口 ====================
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
     print("测试 CGM 同步服务...")
     print(f"数据目录: {DATA_DIR}")
     
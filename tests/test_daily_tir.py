@@ -0,0 +1,75 @@
+"""
+每日 TIR 计算（calculate_daily_tir）测试
+
+运行: python -m pytest -q tests
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+pytest.importorskip("flask")
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """在临时目录中导入 app（Passkey 等模块会在当前目录创建数据文件）"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        yield importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+
+
+def _reading(datetime_str, value):
+    return {"datetime": datetime_str, "value": value, "trend": "Flat"}
+
+
+HISTORY = [
+    _reading("2025-01-12T00:05:00", 12.0),          # 第二天，不计入
+    _reading("2025-01-11T23:55:00+08:00", 9.0),     # 带时区也按本地日期前缀匹配
+    _reading("2025-01-11T14:35:00", 6.5),
+    _reading("2025-01-11T14:30:00", 3.9),           # 边界值计入范围内
+    _reading("2025-01-11T08:00:00", 3.0),
+    _reading("2025-01-11T07:55:00", None),          # 缺失值跳过
+    _reading("2025-01-10T23:55:00", 5.0),           # 前一天，不计入
+]
+
+
+def test_tir_from_local_sync_data(app_module, monkeypatch):
+    loaded = []
+    
+    def fake_load_player_data(player_id):
+        loaded.append(player_id)
+        return {"player_id": player_id, "history": HISTORY}
+    
+    monkeypatch.setattr(app_module, "SYNC_SERVICE_ENABLED", True)
+    monkeypatch.setattr(app_module, "load_player_data", fake_load_player_data)
+    
+    # 当天 4 条有效读数，6.5 和 3.9 在 3.9 - 7.8 范围内
+    assert app_module.calculate_daily_tir("user1", "2025-01-11") == pytest.approx(0.5)
+    assert loaded == ["user1"]
+
+
+def test_tir_without_readings_for_day(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SYNC_SERVICE_ENABLED", True)
+    monkeypatch.setattr(app_module, "load_player_data", lambda player_id: {"history": HISTORY})
+    
+    assert app_module.calculate_daily_tir("user1", "2025-01-05") is None
+
+
+def test_tir_from_api_fallback(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SYNC_SERVICE_ENABLED", False)
+    monkeypatch.setattr(
+        app_module, "get_glucose_history",
+        lambda user_id, minutes, max_count: {"success": True, "history": HISTORY}
+    )
+    
+    assert app_module.calculate_daily_tir("user1", "2025-01-12") == pytest.approx(0.0)
+    assert app_module.calculate_daily_tir("user1", "2025-01-10") == pytest.approx(1.0)